@@ -9,28 +9,126 @@ import os
 import re
 import shutil
 import signal
+import socket
+import socketserver
+import statistics
 import subprocess
 import sys
+import tempfile
+import threading
+import time
 from pathlib import Path
 from argparse import ArgumentParser
-from typing import List, Dict, Set, Tuple, Optional, Any
+from typing import List, Dict, Set, Tuple, Optional, Any, Iterator, TextIO
 import json
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, asdict, replace
+from contextlib import contextmanager, nullcontext
 from concurrent.futures import as_completed, ThreadPoolExecutor
 import hashlib
+import heapq
+import mmap
 import shlex
+import struct
+from array import array
 
 ERRORS_CACHE_FOLDER = Path(".ronin/c_cpp_compile_errors")
-ERRORS_STATE_FILE   = ERRORS_CACHE_FOLDER / "state.json"
+ERRORS_STATE_FILE   = ERRORS_CACHE_FOLDER / "state.bin"
+LEGACY_STATE_FILE   = ERRORS_CACHE_FOLDER / "state.json"
+STATE_JOURNAL       = ERRORS_CACHE_FOLDER / "state.journal"
+STAT_CACHE_FILE     = ERRORS_CACHE_FOLDER / "stat_cache.json"
+DIAGNOSTICS_FILE    = ERRORS_CACHE_FOLDER / "diagnostics.jsonl"
+COMMANDS_CACHE_FILE = ERRORS_CACHE_FOLDER / "commands.json"
+PCH_FOLDER          = ERRORS_CACHE_FOLDER / "pch"
+
+# Where a --serve-worker keeps results, for every client of its host to reuse
+WORKER_RESULT_CACHE = Path.home() / ".cache/ronin/c_cpp_compile_errors/results"
+# One ssh connection per worker host, however many worker processes run over it
+SSH_OPTIONS = ["-o", "ControlMaster=auto",
+               "-o", f"ControlPath={tempfile.gettempdir()}/cce-ssh-%C",
+               "-o", "ControlPersist=60", "-o", "BatchMode=yes",
+               "-o", "ServerAliveInterval=15"]
+DAEMON_SOCKET       = ERRORS_CACHE_FOLDER / "daemon.sock"
+PROFILE_TRACE_FILE  = ERRORS_CACHE_FOLDER / "profile.trace.json"
 
 COMPILE_TIMEOUT_S = 300
 
+# compile_commands.json is read this much at a time: enough to hold any one entry.
+COMMANDS_READ_CHUNK = 1 << 20
+
+# --batch only packs targets whose last compile took less than this: batching is for
+# the thousands of files where starting the compiler is most of the work.
+BATCH_MAX_WALL_S = 1.0
+
+# Admission: compiles start only while their expected peak RSS fits in this share of
+# the memory available when the run began, and while the load average stays under
+# this many times the CPU count. A target never measured is expected to need the
+# median of those that were, or this much with nothing measured at all.
+MEMORY_BUDGET_FRACTION  = 0.8
+LOAD_AVERAGE_PER_CPU    = 1.5
+DEFAULT_EXPECTED_RSS_KB = 512 * 1024
+ADMISSION_POLL_S        = 0.5
+
+# The journal is folded into the snapshot once it is this big, absolutely and
+# relative to the snapshot: replaying it is what every run pays until then.
+JOURNAL_COMPACT_MIN_BYTES = 1 << 20
+JOURNAL_COMPACT_RATIO     = 0.25
+
+# State file: magic, version, path count, target count, header count, path table
+# bytes, dependency ID count, dependent ID count. Bump the version with any change.
+STATE_MAGIC   = b"RONINCCE"
+STATE_VERSION = 4
+STATE_HEADER  = struct.Struct("<8sIIIIQQQ")
+# path ID, content hash, path hash, start and count in the dependency IDs; then,
+# from version 2, the last compile's wall time in seconds and, from version 3, its
+# peak RSS in KiB. Older versions are read with their own record and whatever they
+# lack left at its default.
+TARGET_RECORDS = {
+    1: struct.Struct("<I64s16sQI"),
+    2: struct.Struct("<I64s16sQIf"),
+    3: struct.Struct("<I64s16sQIfI"),
+    4: struct.Struct("<I64s16sQIfI"),
+}
+TARGET_RECORD = TARGET_RECORDS[STATE_VERSION]
+# path ID, content hash, start and count in the dependent IDs; then, from version 4,
+# the token hash (see token_hash)
+HEADER_RECORDS = {
+    1: struct.Struct("<I64sQI"),
+    2: struct.Struct("<I64sQI"),
+    3: struct.Struct("<I64sQI"),
+    4: struct.Struct("<I64sQI64s"),
+}
+HEADER_RECORD = HEADER_RECORDS[STATE_VERSION]
+
 COMPILER_LAUNCHERS = frozenset({"ccache", "sccache", "distcc", "icecc", "icerun",
                                 "buildcache", "gomacc"})
 
+# Matches: /path/to/file.cpp:12:5:message  (errors cached as text, before JSON)
+LEGACY_DIAGNOSTIC_RE = re.compile(r"^(.*?):(\d+):(\d+):(.*)$")
+
 # Matches: #include "/absolute/path/to/file.cpp"  (CMake Unity build includes)
 UNITY_INCLUDE_RE = re.compile(r'^#include\s+"([^"]+\.(?:cpp|cxx|cc|c))"', re.MULTILINE)
 
+# Matches the colon ending a .d file's target, and its prerequisites, escapes included
+DEPENDENCY_RULE_RE   = re.compile(r":(?:\s|$)")
+DEPENDENCY_TOKEN_RE  = re.compile(r"(?:\\ |\S)+")
+DEPENDENCY_ESCAPE_RE = re.compile(r"\\([ #])")
+
+# Matches: #include <vector>  (what a precompiled header is made of)
+SYSTEM_INCLUDE_RE = re.compile(r"^\s*#\s*include\s*<([^>]+)>\s*(?://.*)?$")
+# Matches what a source may start with before, or between, its includes
+SKIPPABLE_LINE_RE = re.compile(r"^\s*(?:$|//|/\*.*\*/\s*$|#\s*pragma\s+once\b)")
+# Matches: module; / export module foo; / import std;  (C++20 modules)
+MODULE_LINE_RE = re.compile(r"^\s*(?:export\s+)?(?:module|import)\b")
+# Matches what token_hash keeps as it is: string and character literals, and the
+# numbers (1'000'000) that could pass for one
+TOKEN_LITERAL = (r""""(?:\\.|[^"\\\n])*"|'(?:\\.|[^'\\\n])*'"""
+                 r"|(?<!\w)\.?\d(?:[eEpP][+-]|'?[\w.])*")
+# Matches a backslash-newline, which joins two lines before anything else is read
+TOKEN_SPLICE_RE = re.compile(r"\\[ \t]*\r?\n")
+# Matches what token_hash drops, comments, or keeps; then what it collapses, whitespace
+TOKEN_SKIP_RE  = re.compile(r"//[^\n]*|/\*.*?\*/|" + TOKEN_LITERAL, re.DOTALL)
+TOKEN_SPACE_RE = re.compile(TOKEN_LITERAL + r"|\s+")
+
 type ContentHash = str
 type PathHash = str
 
@@ -51,25 +149,335 @@ class CompileCommand:
         wrapper, which never changes while its includes do."""
         return self.unity_sources if self.unity_sources else [self.file]
 
-@dataclass
+class StateSnapshot:
+    """A state file, memory-mapped, with only its fixed-size parts decoded.
+
+    Layout, after STATE_HEADER: the path table (NUL-separated), one TARGET_RECORD per
+    target, one HEADER_RECORD per known header, then two arrays of path IDs -- every
+    target's dependencies and every header's dependents, back to back, each record
+    holding its (start, count) into one of them. IDs are in native byte order: the
+    file never leaves the machine that wrote it.
+
+    Records are decoded on load, the ID arrays only when a target's dependencies or
+    a header's dependents are asked for, which a run that rebuilds little never does.
+    """
+
+    def __init__(self, file: Path):
+        with open(file, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        view = memoryview(self._map)
+        (magic, version, npaths, ntargets, nheaders,
+         blob_len, ndeps, nusers) = STATE_HEADER.unpack_from(view)
+        if magic != STATE_MAGIC or version not in TARGET_RECORDS:
+            raise ValueError(f"unsupported state file version {version}")
+        self.target_record = TARGET_RECORDS[version]
+        self.header_record = HEADER_RECORDS[version]
+
+        offset = STATE_HEADER.size
+        blob = bytes(view[offset:offset + blob_len])
+        self.paths = blob.decode("utf8", "surrogateescape").split("\0") if npaths else []
+        offset = _align(offset + blob_len)
+        self.targets = view[offset:offset + ntargets * self.target_record.size]
+        offset += ntargets * self.target_record.size
+        self.headers = view[offset:offset + nheaders * self.header_record.size]
+        offset += nheaders * self.header_record.size
+        self.deps = view[offset:offset + ndeps * 4].cast("I")
+        offset += ndeps * 4
+        self.users = view[offset:offset + nusers * 4].cast("I")
+        if len(self.paths) != npaths or len(self.users) != nusers:
+            raise ValueError("truncated state file")
+
+    def path_set(self, ids: memoryview) -> Set[str]:
+        paths = self.paths
+        return {paths[i] for i in ids}
+
+
 class TargetFile:
-    header_deps: Set[str]
-    content_hash: ContentHash
-    path_hash: PathHash
+    """One analyzed target.
+
+    Loaded from a snapshot, its dependencies stay a (start, count) into the snapshot's
+    ID array until something reads `header_deps`.
+    """
+
+    __slots__ = ("content_hash", "path_hash", "wall_time_s", "peak_rss_kb",
+                 "_header_deps", "_raw_deps")
+
+    def __init__(self, header_deps: Set[str], content_hash: ContentHash, path_hash: PathHash,
+                 wall_time_s: float = 0.0, peak_rss_kb: int = 0):
+        self.content_hash = content_hash
+        self.path_hash = path_hash
+        # How long its last compile took, and the most memory it used; 0 if it never
+        # finished one.
+        self.wall_time_s = wall_time_s
+        self.peak_rss_kb = peak_rss_kb
+        self._header_deps: Optional[Set[str]] = set(header_deps)
+        self._raw_deps: Optional[Tuple[StateSnapshot, int, int]] = None
+
+    @staticmethod
+    def from_snapshot(snapshot: StateSnapshot, content_hash: ContentHash, path_hash: PathHash,
+                      start: int, count: int) -> "TargetFile":
+        target = TargetFile(set(), content_hash, path_hash)
+        target._header_deps = None
+        target._raw_deps = (snapshot, start, count)
+        return target
+
+    def raw_deps(self) -> Optional[Tuple[StateSnapshot, int, int]]:
+        """Where the still undecoded dependencies are in the snapshot, if they are."""
+        return self._raw_deps
+
+    @property
+    def header_deps(self) -> Set[str]:
+        if self._header_deps is None:
+            snapshot, start, count = self._raw_deps
+            self._header_deps = snapshot.path_set(snapshot.deps[start:start + count])
+            self._raw_deps = None
+        return self._header_deps
+
+    @header_deps.setter
+    def header_deps(self, deps: Set[str]) -> None:
+        self._header_deps = deps
+        self._raw_deps = None
+
+
+class Dependents:
+    """header -> the targets that include it, decoding a snapshot's lists on first use."""
+
+    def __init__(self):
+        self._sets: Dict[str, Set[str]] = {}
+        self._raw: Dict[str, Tuple[StateSnapshot, int, int]] = {}
+
+    def _load(self, header: str) -> None:
+        raw = self._raw.pop(header, None)
+        if raw is not None:
+            snapshot, start, count = raw
+            self._sets[header] = snapshot.path_set(snapshot.users[start:start + count])
+
+    def set_raw(self, header: str, snapshot: StateSnapshot, start: int, count: int) -> None:
+        self._raw[header] = (snapshot, start, count)
+
+    def raw(self, header: str) -> Optional[Tuple[StateSnapshot, int, int]]:
+        return self._raw.get(header)
+
+    def get(self, header: str, default=None):
+        self._load(header)
+        return self._sets.get(header, default)
+
+    def setdefault(self, header: str, default: Set[str]) -> Set[str]:
+        self._load(header)
+        return self._sets.setdefault(header, default)
+
+    def __getitem__(self, header: str) -> Set[str]:
+        self._load(header)
+        return self._sets[header]
+
+    def __delitem__(self, header: str) -> None:
+        self._raw.pop(header, None)
+        self._sets.pop(header, None)
+
+    def __contains__(self, header: str) -> bool:
+        return header in self._sets or header in self._raw
+
+    def __iter__(self):
+        return iter([*self._sets, *self._raw])
+
+    def __len__(self) -> int:
+        return len(self._sets) + len(self._raw)
+
+    def load_all(self) -> None:
+        for header in list(self._raw):
+            self._load(header)
+
+
+class PathTable:
+    """Paths interned to the IDs the state file stores.
+
+    Append-only between saves, so IDs read from the last snapshot stay valid in the
+    next one and an untouched dependency list is copied across without decoding it.
+    """
+
+    def __init__(self, paths: Optional[List[str]] = None):
+        self.paths: List[str] = paths or []
+        self.ids: Dict[str, int] = {p: i for i, p in enumerate(self.paths)}
+
+    def intern(self, path: str) -> int:
+        i = self.ids.get(path)
+        if i is None:
+            i = self.ids[path] = len(self.paths)
+            self.paths.append(path)
+        return i
+
 
 @dataclass
 class State:
     targets: Dict[str, TargetFile]
     unique_deps: Dict[str, ContentHash]
+    # header -> its token_hash, for headers whose token hash is known
+    token_hashes: Dict[str, str] = field(default_factory=dict)
+    # Inverse of every target's header_deps: header -> the targets that include it.
+    # A header nothing includes any more has no entry.
+    dependents: Dependents = field(default_factory=Dependents)
+    table: PathTable = field(default_factory=PathTable)
 
     @staticmethod
     def from_dict(data: Dict) -> "State":
+        """A state from the JSON file older versions wrote."""
         targets = {
             k: TargetFile(**v) for k, v in data.get("targets", {}).items()
         }
-        for t in targets.values():
-            t.header_deps = set(t.header_deps)
-        return State(targets=targets, unique_deps=data.get("unique_deps", {}))
+        state = State(targets=targets, unique_deps=data.get("unique_deps", {}))
+        for k, t in targets.items():
+            for dep in t.header_deps:
+                state.dependents.setdefault(dep, set()).add(k)
+        return state
+
+    @staticmethod
+    def from_snapshot(snapshot: StateSnapshot) -> "State":
+        paths = snapshot.paths
+        state = State(targets={}, unique_deps={}, table=PathTable(list(paths)))
+        for path_id, content, path_hash, start, count, *added in \
+                snapshot.target_record.iter_unpack(snapshot.targets):
+            target = TargetFile.from_snapshot(snapshot, _unpack_hex(content),
+                                              _unpack_hex(path_hash), start, count)
+            if added:
+                target.wall_time_s = added[0]
+            if len(added) > 1:
+                target.peak_rss_kb = added[1]
+            state.targets[paths[path_id]] = target
+        for path_id, content, start, count, *added in \
+                snapshot.header_record.iter_unpack(snapshot.headers):
+            state.unique_deps[paths[path_id]] = _unpack_hex(content)
+            if added and any(added[0]):
+                state.token_hashes[paths[path_id]] = added[0].hex()
+            state.dependents.set_raw(paths[path_id], snapshot, start, count)
+        return state
+
+    def set_header_deps(self, file: str, header_deps: Set[str]) -> None:
+        """Replace a target's dependencies, keeping `dependents` in step."""
+        target = self.targets[file]
+        for dep in target.header_deps - header_deps:
+            users = self.dependents[dep]
+            users.discard(file)
+            if not users:
+                del self.dependents[dep]
+                self.unique_deps.pop(dep, None)
+                self.token_hashes.pop(dep, None)
+        for dep in header_deps - target.header_deps:
+            self.dependents.setdefault(dep, set()).add(file)
+        target.header_deps = header_deps
+
+    def remove_target(self, file: str) -> None:
+        self.set_header_deps(file, set())
+        del self.targets[file]
+
+    def load_all(self) -> None:
+        """Decode everything still left in the snapshot."""
+        for target in self.targets.values():
+            target.header_deps
+        self.dependents.load_all()
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def _unpack_hex(digest: bytes) -> str:
+    """A stored digest back to its hex string; all zeroes is the empty hash."""
+    return digest.hex() if any(digest) else ""
+
+
+def _pack_ids(table: PathTable, paths: Set[str]) -> bytes:
+    return array("I", sorted(table.intern(p) for p in paths)).tobytes()
+
+@dataclass(frozen=True)
+class Diagnostic:
+    file: str
+    line: int
+    column: int
+    severity: str
+    message: str
+
+    def text(self) -> str:
+        return f"{self.file}:{self.line}:{self.column}:{self.message}"
+
+    def cache_line(self) -> str:
+        return json.dumps(asdict(self)) + "\n"
+
+    @staticmethod
+    def from_cache_line(line: str) -> "Diagnostic":
+        try:
+            return Diagnostic(**json.loads(line))
+        except (ValueError, TypeError):
+            pass
+        # Written before diagnostics were cached as JSON: file:line:column:message.
+        m = LEGACY_DIAGNOSTIC_RE.match(line.rstrip("\n"))
+        if m is None:
+            return Diagnostic("<unknown>", 0, 0, "error", line.rstrip("\n"))
+        return Diagnostic(m[1], int(m[2]), int(m[3]), "error", m[4])
+
+
+class DiagnosticPrinter:
+    """Prints each target's errors as soon as it finishes, each distinct one only once.
+
+    A broken header included by a hundred targets is one error, not a hundred: after
+    the first target reports it, the rest are dropped. --format jsonl prints one record
+    per error, naming the target that reported it, whether that came from cache, and
+    whether its "owner" is that target's own source or a header it includes.
+    """
+
+    def __init__(self, out: TextIO, fmt: str):
+        self._out = out
+        self._jsonl = fmt == "jsonl"
+        self._seen: Set[Diagnostic] = set()
+        # header -> the targets that reported errors in it
+        self._sharers: Dict[str, Set[str]] = {}
+
+    def emit(self, diagnostics: Set[Diagnostic], tu: str, cached: bool,
+             sources: Optional[List[str]] = None) -> None:
+        sources = sources or [tu]
+        for d in diagnostics:
+            if not self._owned_by(d, sources):
+                self._sharers.setdefault(d.file, set()).add(tu)
+        fresh = sorted((d for d in diagnostics if d not in self._seen),
+                       key=lambda d: (d.file, d.line, d.column, d.message))
+        if not fresh:
+            return
+        self._seen.update(fresh)
+        for d in fresh:
+            if self._jsonl:
+                owner = "source" if self._owned_by(d, sources) else "header"
+                print(json.dumps({**asdict(d), "tu": tu, "cached": cached, "owner": owner}),
+                      file=self._out)
+            else:
+                print(d.text(), file=self._out)
+        # Piped, stdout is block-buffered: flush, or "as soon as" means "at exit".
+        self._out.flush()
+
+    def summary(self, err: TextIO) -> None:
+        """Name the headers whose errors more than one target reported."""
+        for header, tus in sorted(self._sharers.items(), key=lambda kv: -len(kv[1])):
+            if len(tus) > 1:
+                count = sum(1 for d in self._seen if d.file == header)
+                print(f"[INFO] {header}: {count} error(s), reported by {len(tus)} target(s) "
+                      f"that include it, shown once", file=err)
+
+    @staticmethod
+    def _owned_by(d: Diagnostic, sources: List[str]) -> bool:
+        """Whether `d` is in one of `sources`; a relative path is matched by name."""
+        if os.path.isabs(d.file):
+            return d.file in sources or os.path.realpath(d.file) in sources
+        return any(os.path.basename(s) == os.path.basename(d.file) for s in sources)
+
+
+@dataclass
+class CompileResult:
+    errors: Set[Diagnostic]
+    header_deps: Set[str] = field(default_factory=set)
+    wall_time_s: float = 0.0
+    peak_rss_kb: int = 0
+    # Every file the compile read but system headers, wherever it is: what a cached
+    # copy of this result is only good for while unchanged
+    inputs: Set[str] = field(default_factory=set)
+
 
 def parse_unity_sources(file: str) -> List[str]:
     """Return the list of .cpp/.cxx source files included by a CMake Unity build file."""
@@ -83,12 +491,22 @@ def parse_unity_sources(file: str) -> List[str]:
     except (OSError, UnicodeDecodeError):
         return []
 
+def is_unity_file(file: str) -> bool:
+    """Whether `file` is named like a CMake Unity wrapper (unity_0_cxx.cxx)."""
+    return os.path.basename(file).lower().startswith("unity_")
+
+def split_command(command: str) -> List[str]:
+    """shlex.split, skipped for the usual command with nothing in it to unquote"""
+    if any(c in command for c in "'\"\\"):
+        return shlex.split(command)
+    return command.split()
+
 def extract_command(cmd_entry: Dict) -> List[str]:
     """Prefer 'arguments' array over 'command' string to bypass shlex.split"""
     if "arguments" in cmd_entry:
         parts = cmd_entry["arguments"][:]
     else:
-        parts = shlex.split(cmd_entry.get("command", ""))
+        parts = split_command(cmd_entry.get("command", ""))
     
     if "-o" in parts:
         idx = parts.index("-o")
@@ -133,29 +551,85 @@ def is_clang_compiler(command: List[str]) -> bool:
     return any("clang" in Path(word).name.lower() for word in split_compiler(command)[0])
 
 
+def iter_compile_commands(compile_commands_path: str) -> Iterator[Dict]:
+    """Yield the entries of compile_commands.json one at a time.
+
+    json.load on a 300 MB database builds every entry before the first is looked at,
+    and holds them all while the few under the prefix are picked out. Decoding one
+    array element at a time keeps a chunk and an entry in memory instead.
+    """
+    decoder = json.JSONDecoder()
+    with open(compile_commands_path, "r", encoding="utf8") as infile:
+        buf = ""
+        while not buf and (chunk := infile.read(COMMANDS_READ_CHUNK)):
+            buf = chunk.lstrip()
+        if not buf.startswith("["):
+            raise json.JSONDecodeError("Expecting '['", buf, 0)
+        pos = 1
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos < len(buf):
+                if buf[pos] == "]":
+                    return
+                try:
+                    entry, pos = decoder.raw_decode(buf, pos)
+                    yield entry
+                    continue
+                except json.JSONDecodeError:
+                    pass  # most likely the entry runs past the end of the buffer
+            chunk = infile.read(COMMANDS_READ_CHUNK)
+            if not chunk:
+                raise json.JSONDecodeError("Unterminated compile_commands.json", buf, pos)
+            buf, pos = buf[pos:] + chunk, 0
+
+
 def get_commands_of_interest(compile_commands_path: str, path_prefix: str,
                              cxx: Optional[str], cc: Optional[str],
-                             analysis_flags: List[str]) -> Dict[str, CompileCommand]:
+                             analysis_flags: List[str],
+                             use_cache: bool = True) -> Dict[str, CompileCommand]:
+    """The commands of compile_commands.json whose sources are under `path_prefix`.
+
+    Entries are filtered on their path strings before anything touches the disk: a
+    file outside the prefix is dropped without a stat, and only files named like
+    Unity wrappers are opened to find what they include. The result is cached in
+    the cache folder, keyed by the database's content hash and the arguments, so a
+    run against an unchanged database reads back only the commands it kept.
+    """
+    key = [os.path.abspath(compile_commands_path), path_prefix, cxx, cc, analysis_flags]
+    db_hash = get_file_content_hash(compile_commands_path) if use_cache else ""
+    if use_cache:
+        cached = load_commands_cache(key, db_hash)
+        PROFILE.count("commands cache hit" if cached is not None else "commands cache miss")
+        if cached is not None:
+            return cached
+
     prefix = Path(path_prefix)
-    with open(compile_commands_path, "r", encoding="utf8") as infile:
-        commands = json.load(infile)
+    # A cheap string test first; is_relative_to then settles "/src" against "/src2".
+    prefix_str = str(prefix)
     out = {}
-    for c in commands:
-        file = Path(c["file"])
-        if not file.exists():
-            continue
-
-        unity_sources = parse_unity_sources(c["file"])
-
+    # Wrappers read and files found missing: what a cached result depends on besides
+    # the database itself.
+    unity_files, missing = {}, []
+    for c in iter_compile_commands(compile_commands_path):
+        file_str = c["file"]
+        unity_sources = []
+        if is_unity_file(file_str):
+            unity_sources = parse_unity_sources(file_str)
+            unity_files[file_str] = get_file_content_hash(file_str) if use_cache else ""
         if unity_sources:
             if not any(Path(s).is_relative_to(prefix) for s in unity_sources):
                 continue
-        else:
-            if not file.is_relative_to(prefix):
-                continue
+        elif not (file_str.startswith(prefix_str) and Path(file_str).is_relative_to(prefix)):
+            continue
+
+        file = Path(file_str)
+        if not file.exists():
+            missing.append(file_str)
+            continue
 
         cmd = CompileCommand(
-            file=c["file"],
+            file=file_str,
             command=extract_command(c),
             unity_sources=unity_sources,
         )
@@ -166,28 +640,268 @@ def get_commands_of_interest(compile_commands_path: str, path_prefix: str,
         if replacement:
             cmd.command = replace_compiler(cmd.command, replacement)
 
-        out[c["file"]] = cmd
+        out[file_str] = cmd
+
+    if use_cache:
+        save_commands_cache(key, db_hash, out, unity_files, missing)
     return out
 
+
+def load_commands_cache(key: List, db_hash: str) -> Optional[Dict[str, CompileCommand]]:
+    """The cached commands for `key`, or None if they may be out of date.
+
+    Besides the database, a result depends on the Unity wrappers it read and on the
+    files it skipped for not existing, so those are checked too: by stat, through the
+    stat cache, which is nothing next to reparsing.
+    """
+    try:
+        with open(COMMANDS_CACHE_FILE, "r", encoding="utf8") as infile:
+            cached = json.load(infile)
+    except (OSError, ValueError):
+        return None
+    if cached.get("key") != key or not db_hash or cached.get("db") != db_hash:
+        return None
+    if any(get_file_content_hash(f) != h for f, h in cached["unity"].items()):
+        return None
+    if any(os.path.exists(f) for f in cached["missing"]):
+        return None
+    cmds = {}
+    for file, command, unity_sources in cached["commands"]:
+        if not os.path.exists(file):
+            return None
+        cmds[file] = CompileCommand(file=file, command=command, unity_sources=unity_sources)
+    return cmds
+
+
+def save_commands_cache(key: List, db_hash: str, cmds: Dict[str, CompileCommand],
+                        unity_files: Dict[str, str], missing: List[str]) -> None:
+    if not db_hash:
+        return
+    cached = {"key": key, "db": db_hash, "unity": unity_files, "missing": missing,
+              "commands": [[c.file, c.command, c.unity_sources] for c in cmds.values()]}
+    tmp = COMMANDS_CACHE_FILE.with_suffix(".tmp")
+    try:
+        with open(tmp, "w", encoding="utf8") as outfile:
+            json.dump(cached, outfile, separators=(",", ":"))
+        os.replace(tmp, COMMANDS_CACHE_FILE)
+    except OSError:
+        pass
+
 def get_file_hash(file: str) -> str:
     return hashlib.blake2b(file.encode(), digest_size=16).hexdigest()
 
+class Profiler:
+    """--profile: where a run's time goes, as a Chrome trace and a summary.
+
+    Spans are complete trace events ("ph": "X") on the thread that ran them: the
+    phases of a run on the main thread, each compile on its pool thread. Counters
+    are plain sums. Disabled, which is every run without --profile, `span` and
+    `count` return at the first check.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._epoch = 0
+        self._events: List[Dict] = []
+        self.counters: Dict[str, int] = {}
+
+    def start(self) -> None:
+        with self._lock:
+            self.enabled = True
+            self._epoch = time.perf_counter_ns()
+            self._events = []
+            self.counters = {}
+
+    def stop(self) -> None:
+        self.enabled = False
+
+    @contextmanager
+    def span(self, name: str, category: str = "phase", **trace_args):
+        if not self.enabled:
+            yield
+            return
+        begin = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            self.add_span(name, begin, category, **trace_args)
+
+    def add_span(self, name: str, begin_ns: int, category: str = "phase", **trace_args) -> None:
+        """A span from `begin_ns` (perf_counter_ns) to now, for one no `with` fits around."""
+        if not self.enabled:
+            return
+        end = time.perf_counter_ns()
+        event = {"name": name, "cat": category, "ph": "X", "pid": os.getpid(),
+                 "tid": threading.get_native_id(), "ts": (begin_ns - self._epoch) / 1000,
+                 "dur": (end - begin_ns) / 1000}
+        if trace_args:
+            event["args"] = trace_args
+        with self._lock:
+            self._events.append(event)
+
+    def count(self, name: str, n: int = 1) -> None:
+        if self.enabled:
+            with self._lock:
+                self.counters[name] = self.counters.get(name, 0) + n
+
+    def spans(self, category: str) -> List[Dict]:
+        with self._lock:
+            return [e for e in self._events if e["cat"] == category]
+
+    def write_trace(self, path: Path) -> None:
+        """The trace, for chrome://tracing or ui.perfetto.dev."""
+        with self._lock:
+            events = list(self._events)
+        with open(path, "w", encoding="utf8") as outfile:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, outfile)
+
+    def report(self, top: int, slots: int, err: TextIO) -> None:
+        """Phase times, the slowest compiles, hashing, hit rates and pool utilization."""
+        phases: Dict[str, float] = {}
+        for e in self.spans("phase"):
+            phases[e["name"]] = phases.get(e["name"], 0.0) + e["dur"] / 1e6
+        for name, seconds in phases.items():
+            print(f"[PROFILE] {name:<24} {seconds:8.3f}s", file=err)
+
+        compiles = sorted(self.spans("compile"), key=lambda e: e["dur"], reverse=True)
+        for e in compiles[:top]:
+            print(f"[PROFILE] {e['dur'] / 1e6:8.3f}s  {e['name']}", file=err)
+
+        c = self.counters
+        print(f"[PROFILE] hashed {c.get('bytes hashed', 0) / 2**20:.1f} MiB in "
+              f"{c.get('files hashed', 0)} file(s)", file=err)
+        for cache in ("stat cache", "commands cache", "result cache", "pch"):
+            hits, misses = c.get(f"{cache} hit", 0), c.get(f"{cache} miss", 0)
+            if hits + misses:
+                print(f"[PROFILE] {cache}: {hits}/{hits + misses} hit "
+                      f"({100 * hits / (hits + misses):.0f}%)", file=err)
+
+        window = phases.get("compile", 0.0)
+        if compiles and window > 0:
+            busy = sum(e["dur"] for e in compiles) / 1e6
+            print(f"[PROFILE] pool: {busy:.2f}s of compiles in {window:.2f}s on {slots} slot(s), "
+                  f"{100 * busy / (window * slots):.0f}% utilized", file=err)
+        print(f"[PROFILE] trace written to {PROFILE_TRACE_FILE}", file=err)
+
+
+PROFILE = Profiler()
+
+
+class StatCache:
+    """File digests that are trusted for as long as the file's stat says it is untouched.
+
+    The way git's index avoids rereading the worktree: (mtime_ns, size, inode, ctime_ns)
+    is recorded next to each digest, and a file is only read again once one of them
+    moves. A file modified within RACY_WINDOW_NS of being hashed could change again
+    without its mtime moving, so its signature is not recorded and it is rehashed next
+    time -- git's "racily clean" entries.
+    """
+
+    RACY_WINDOW_NS = 2_000_000_000
+
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Optional[Tuple[int, int, int, int]], str]] = {}
+        self._changed = False
+
+    def digest(self, file: str) -> Optional[str]:
+        """The file's blake2b hex digest, or None if it cannot be read."""
+        try:
+            st = os.stat(file)
+        except OSError:
+            self._forget(file)
+            return None
+        signature = (st.st_mtime_ns, st.st_size, st.st_ino, st.st_ctime_ns)
+        entry = self._entries.get(file)
+        if entry is not None and entry[0] == signature:
+            PROFILE.count("stat cache hit")
+            return entry[1]
+        PROFILE.count("stat cache miss")
+        try:
+            with open(file, "rb") as f:
+                digest = hashlib.file_digest(f, "blake2b").hexdigest()
+        except OSError:
+            self._forget(file)
+            return None
+        PROFILE.count("files hashed")
+        PROFILE.count("bytes hashed", st.st_size)
+        if time.time_ns() - max(st.st_mtime_ns, st.st_ctime_ns) < self.RACY_WINDOW_NS:
+            signature = None
+        self._entries[file] = (signature, digest)
+        self._changed = True
+        return digest
+
+    def _forget(self, file: str) -> None:
+        if self._entries.pop(file, None) is not None:
+            self._changed = True
+
+    def load(self) -> None:
+        """Last run's entries; anything unreadable just means hashing everything once."""
+        try:
+            with open(STAT_CACHE_FILE, "r", encoding="utf8") as infile:
+                data = json.load(infile)
+            self._entries = {path: (tuple(sig) if sig else None, digest)
+                             for path, (sig, digest) in data["entries"].items()}
+        except (json.JSONDecodeError, OSError, TypeError, KeyError, ValueError):
+            self._entries = {}
+
+    def save(self) -> None:
+        """Write the cache out, unless this run found every entry still good."""
+        if not self._changed:
+            return
+        self._changed = False
+        tmp = STAT_CACHE_FILE.with_suffix(".json.tmp")
+        with open(tmp, "w", encoding="utf8") as outfile:
+            json.dump({"entries": self._entries}, outfile)
+        os.replace(tmp, STAT_CACHE_FILE)
+
+
+STAT_CACHE = StatCache()
+
 def get_file_content_hash(file: str) -> str:
+    return STAT_CACHE.digest(file) or ""
+
+_TOKEN_HASHES: Dict[str, str] = {}
+
+def token_hash(file: str, content_hash: str) -> str:
+    """A hash of `file` that edits to comments and whitespace leave alone; "" if unsure.
+
+    Backslash-newlines are joined first, so a // comment ending in one takes the next
+    line with it; comments then become a space, as the preprocessor has it, and runs of
+    whitespace become one and blank lines go; line breaks stay, since directives end at
+    them. Inside literals nothing changes: "a  b" is not "a b". A header with raw
+    strings, which this cannot tell from code, or that uses __LINE__, which a removed
+    line changes, gets no token hash. Memoized by content, and "" if `file` no longer
+    has `content_hash` either.
+    """
+    if content_hash in _TOKEN_HASHES:
+        return _TOKEN_HASHES[content_hash]
     try:
-        with open(file, "rb") as f:
-            return hashlib.file_digest(f, "blake2b").hexdigest()
+        data = Path(file).read_bytes()
     except OSError:
         return ""
+    if hashlib.blake2b(data).hexdigest() != content_hash:
+        return ""
+    text = data.decode("utf8", "surrogateescape")
+    if 'R"' in text or "__LINE__" in text:
+        digest = ""
+    else:
+        text = TOKEN_SPLICE_RE.sub("", text)
+        text = TOKEN_SKIP_RE.sub(lambda m: " " if m[0][0] == "/" else m[0], text)
+        text = TOKEN_SPACE_RE.sub(lambda m: m[0] if not m[0][0].isspace()
+                                  else "\n" if "\n" in m[0] else " ", text)
+        lines = (line.strip() for line in text.split("\n"))
+        digest = hashlib.blake2b("\n".join(l for l in lines if l).encode(
+            "utf8", "surrogateescape")).hexdigest()
+    _TOKEN_HASHES[content_hash] = digest
+    return digest
 
 def get_combined_content_hash(files: List[str]) -> str:
     h = hashlib.blake2b()
     for file in sorted(files):
-        try:
-            with open(file, "rb") as f:
-                file_h = hashlib.file_digest(f, "blake2b")
-                h.update(file_h.digest())
-        except OSError:
-            pass
+        digest = STAT_CACHE.digest(file)
+        if digest is not None:
+            h.update(bytes.fromhex(digest))
     return h.hexdigest()
 
 def hash_sources(cmds: Dict[str, CompileCommand], pool: ThreadPoolExecutor) -> None:
@@ -202,27 +916,21 @@ def hash_sources(cmds: Dict[str, CompileCommand], pool: ThreadPoolExecutor) -> N
         cmd.content_hash = digest
 
 
-def prime_header_hashes(state: State, pool: ThreadPoolExecutor) -> Dict[str, str]:
+def prime_header_hashes(state: State, pool: ThreadPoolExecutor,
+                        known: Optional[Dict[str, str]] = None) -> Dict[str, str]:
     """Hash last run's known headers up front, in parallel.
 
     get_needs_recompile stops at the first changed dependency, so on a tree where
     little moved it ends up hashing nearly every header anyway -- one parallel pass is
     the same work without the wait. On a first run there is no previous state, so this
-    costs nothing.
+    costs nothing. Headers already in `known` are skipped.
     """
-    deps = sorted({dep for target in state.targets.values() for dep in target.header_deps
-                   if os.path.exists(dep)})
+    known = known or {}
+    deps = sorted(dep for dep in state.dependents if dep not in known and os.path.exists(dep))
     return dict(zip(deps, pool.map(get_file_content_hash, deps)))
 
 
-def read_cache(cmd: CompileCommand, cached_deps: Set[str]) -> Tuple[Set[str], Set[str]]:
-    cache_file = ERRORS_CACHE_FOLDER / f"{cmd.path_hash}.errors"
-    if not cache_file.exists():
-        return set(), cached_deps
-    with open(cache_file, "r", encoding="utf8") as infile:
-        return set(infile.readlines()), cached_deps
-
-def parse_clang_sarif(diagnostics: dict) -> Set[str]:
+def parse_clang_sarif(diagnostics: dict) -> Set[Diagnostic]:
     """Flattens and parses Clang's SARIF JSON output."""
     errors = set()
     results = (
@@ -241,11 +949,11 @@ def parse_clang_sarif(diagnostics: dict) -> Set[str]:
             region = phys_loc.get("region", {})
             line = region.get("startLine", 0)
             col = region.get("startColumn", 0)
-            errors.add(f"{file_path}:{line}:{col}:{message}\n")
+            errors.add(Diagnostic(file_path, line, col, result["level"], message))
             
     return errors
 
-def parse_gcc_json(diagnostics: Any) -> Set[str]:
+def parse_gcc_json(diagnostics: Any) -> Set[Diagnostic]:
     """Flattens and parses GCC's custom JSON output."""
     errors = set()
     diags_list = diagnostics if isinstance(diagnostics, list) else [diagnostics]
@@ -259,32 +967,273 @@ def parse_gcc_json(diagnostics: Any) -> Set[str]:
             file_path = caret.get("file", "<unknown>")
             line = caret.get("line", 0)
             col = caret.get("column", 0)
-            errors.add(f"{file_path}:{line}:{col}:{message}\n")
+            errors.add(Diagnostic(file_path, line, col, diag["kind"], message))
             
     return errors
 
+def parse_make_prerequisites(text: str) -> List[str]:
+    """The prerequisites of the first rule in a .d file, unescaped.
+
+    Just the Make a compiler writes with -MD: backslash-newline continuations, "\\ "
+    and "\\#" for a space or a hash in a name, "$$" for a "$". Phony rules -MP adds
+    follow the first, on lines of their own, and are ignored. The usual file has no
+    escapes at all and is split on whitespace and nothing more.
+    """
+    text = text.replace("\\\r\n", " ").replace("\\\n", " ")
+    rule = text.split("\n", 1)[0]
+    # The target ends at a colon followed by whitespace: a drive letter's is not
+    sep = DEPENDENCY_RULE_RE.search(rule)
+    if sep is None:
+        return []
+    prerequisites = rule[sep.end():]
+    if "\\" not in prerequisites and "$" not in prerequisites:
+        return prerequisites.split()
+    return [DEPENDENCY_ESCAPE_RE.sub(r"\1", token).replace("$$", "$")
+            for token in DEPENDENCY_TOKEN_RE.findall(prerequisites)]
+
+
+class ResolveCache:
+    """realpath, once per distinct path per run.
+
+    A .d file names every header by the path the compiler found it at; a thousand
+    targets including <vector> would each resolve the same few hundred paths. Entries
+    are only trusted for one run, as a symlink can be repointed between two.
+    """
+
+    def __init__(self):
+        self._paths: Dict[str, str] = {}
+
+    def resolve(self, path: str) -> str:
+        resolved = self._paths.get(path)
+        if resolved is None:
+            # Unlocked: two threads resolving one path both get the same answer
+            resolved = self._paths[path] = os.path.realpath(path)
+        return resolved
+
+    def clear(self) -> None:
+        self._paths = {}
+
+
+RESOLVE_CACHE = ResolveCache()
+
+
+def is_under(path: str, prefix: str) -> bool:
+    """Whether `path` is `prefix` or in it; both resolved, and compared as strings."""
+    return path.startswith(prefix) and (len(path) == len(prefix) or prefix.endswith(os.sep)
+                                        or path[len(prefix)] == os.sep)
+
+
 def parse_dependency_file(d_file: Path, prefix_path: Path) -> Set[str]:
     """Reads a .d file and returns resolved dependencies within the prefix path."""
-    if not d_file.exists():
-        return set()
-        
     try:
-        content = d_file.read_text(encoding="utf8").replace("\\\n", "")
-        parts = shlex.split(content)
-        if len(parts) <= 1:
-            return set()
-            
-        # parts[0] is the target (e.g., 'main.o:'), parts[1:] are the headers
-        paths = (Path(d).resolve() for d in parts[1:])
-        return {str(p) for p in paths if p.is_relative_to(prefix_path)}
-    except Exception:
+        text = d_file.read_text(encoding="utf8")
+    except (OSError, UnicodeDecodeError):
         return set()
+    prefix = str(prefix_path)
+    paths = map(RESOLVE_CACHE.resolve, parse_make_prerequisites(text))
+    return {p for p in paths if is_under(p, prefix)}
+
+def read_meminfo_kb(field_name: str) -> Optional[int]:
+    """A /proc/meminfo field in KiB, or None where there is no /proc (macOS)."""
+    try:
+        with open("/proc/meminfo", "r", encoding="ascii") as f:
+            for line in f:
+                name, _, value = line.partition(":")
+                if name == field_name:
+                    return int(value.split()[0])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def expected_rss_kb(state: State) -> Dict[str, int]:
+    """Each known target's expected peak RSS, and the guess for the rest under ``""``."""
+    known = {k: t.peak_rss_kb for k, t in state.targets.items() if t.peak_rss_kb > 0}
+    guess = int(statistics.median(known.values())) if known else DEFAULT_EXPECTED_RSS_KB
+    return known | {"": guess}
+
+
+class CompilerKilled(Exception):
+    """The compiler died of a SIGKILL that was not ours: on Linux, the OOM killer."""
+
+    def __init__(self, file: str, peak_rss_kb: int):
+        super().__init__(f"killed by SIGKILL (out of memory?): {file}")
+        self.peak_rss_kb = peak_rss_kb
+
+
+class AdmissionController:
+    """Decides when the next compile may start, so -j never means -j OOM.
+
+    The pool still caps how many run at once; this holds a worker back until the
+    compile it is about to start fits. Each running compile reserves its expected
+    peak RSS against a budget taken from MemAvailable when the run began, and nothing
+    starts while the live MemAvailable could not cover it either (someone else's
+    build, a browser) or while the load average says the machine is already busy.
+    Compiles are admitted in the order they ask, so the 4 GiB template monster
+    scheduled first is not starved by a stream of small ones slipping past it. When
+    nothing is running the next one is always admitted, or a target bigger than the
+    budget would never build.
+
+    A compiler the kernel kills anyway makes the budget shrink to what was reserved
+    at the time, and the target is retried once with the machine to itself.
+    """
+
+    def __init__(self):
+        available = read_meminfo_kb("MemAvailable")
+        self._budget_kb = None if available is None else int(available * MEMORY_BUDGET_FRACTION)
+        self._load_limit = LOAD_AVERAGE_PER_CPU * (os.cpu_count() or 1)
+        self._cond = threading.Condition()
+        self._queue: List[int] = []
+        self._next_ticket = 0
+        self._running = 0
+        self._reserved_kb = 0
+        self._exclusive = False
+        self.held_back = 0
+        self.oom_kills = 0
+
+    def _fits(self, expected_kb: int, exclusive: bool) -> bool:
+        if self._running == 0:
+            return True
+        if exclusive or self._exclusive:
+            return False
+        if self._budget_kb is not None:
+            if self._reserved_kb + expected_kb > self._budget_kb:
+                return False
+            available = read_meminfo_kb("MemAvailable")
+            if available is not None and available * MEMORY_BUDGET_FRACTION < expected_kb:
+                return False
+        try:
+            return os.getloadavg()[0] <= self._load_limit
+        except OSError:
+            return True
+
+    def acquire(self, expected_kb: int, exclusive: bool = False) -> None:
+        with self._cond:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            self._queue.append(ticket)
+            waited = False
+            # Memory and load change without anyone notifying: poll them while waiting.
+            while self._queue[0] != ticket or not self._fits(expected_kb, exclusive):
+                waited = True
+                self._cond.wait(ADMISSION_POLL_S)
+            self._queue.pop(0)
+            self.held_back += waited
+            self._running += 1
+            self._reserved_kb += expected_kb
+            self._exclusive = exclusive
+            self._cond.notify_all()
+
+    def release(self, expected_kb: int) -> None:
+        with self._cond:
+            self._running -= 1
+            self._reserved_kb -= expected_kb
+            self._exclusive = False
+            self._cond.notify_all()
+
+    def back_off(self) -> None:
+        """Shrink the budget to what was reserved when a compiler got OOM-killed."""
+        with self._cond:
+            self.oom_kills += 1
+            if self._budget_kb is not None:
+                self._budget_kb = min(self._budget_kb, self._reserved_kb)
+
+
+class Superseded(Exception):
+    """A compile of a target whose source a --focus request has seen a newer version of."""
+
+
+class InFlight:
+    """The compilers running right now, so a newer save of a file can stop its old compile.
+
+    A --focus request supersedes its targets at the content hash it saw: any compile
+    of one at another hash is killed, process group and all, and one about to start
+    never does. Full runs forget that at their start: by then they hash the file
+    themselves. Only compiles on this machine are known; one on a worker finishes, and
+    its result, recorded at the old hash, is simply redone by the next run.
+    """
 
-def run_cmd(cmd: CompileCommand, prefix_path: Path) -> Tuple[Set[str], Set[str]]:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._running: Dict[subprocess.Popen, CompileCommand] = {}
+        self._killed: Set[subprocess.Popen] = set()
+        self._latest: Dict[str, ContentHash] = {}
+
+    def _stale(self, cmd: CompileCommand) -> bool:
+        return self._latest.get(cmd.file, cmd.content_hash) != cmd.content_hash
+
+    def admit(self, cmd: CompileCommand) -> None:
+        with self._lock:
+            if self._stale(cmd):
+                raise Superseded(cmd.file)
+
+    def add(self, cmd: CompileCommand, process: subprocess.Popen) -> None:
+        with self._lock:
+            self._running[process] = cmd
+            if self._stale(cmd):
+                self._kill(process)
+
+    def remove(self, process: subprocess.Popen) -> bool:
+        """Forget `process`, once reaped; whether it was killed as superseded."""
+        with self._lock:
+            del self._running[process]
+            killed = process in self._killed
+            self._killed.discard(process)
+            return killed
+
+    def supersede(self, file: str, content_hash: ContentHash) -> int:
+        """Kill the compiles of `file` at any other hash; returns how many."""
+        with self._lock:
+            self._latest[file] = content_hash
+            stale = [p for p, cmd in self._running.items() if self._stale(cmd)]
+            for process in stale:
+                self._kill(process)
+            return len(stale)
+
+    def forget(self) -> None:
+        with self._lock:
+            self._latest.clear()
+
+    def _kill(self, process: subprocess.Popen) -> None:
+        self._killed.add(process)
+        try:
+            os.killpg(process.pid, signal.SIGKILL)  # session leader, so pid == pgid
+        except ProcessLookupError:
+            pass
+
+IN_FLIGHT = InFlight()
+
+def run_cmd(cmd: CompileCommand, prefix_path: Path,
+            admission: Optional[AdmissionController] = None,
+            expected_kb: int = DEFAULT_EXPECTED_RSS_KB) -> CompileResult:
     """Compile and discover dependencies in the same pass using -MMD"""
-    cache_file = ERRORS_CACHE_FOLDER / f"{cmd.path_hash}.errors"
-    d_file = ERRORS_CACHE_FOLDER / f"{cmd.path_hash}.d"
-    
+    # The .d file only lives until it is parsed, so it goes to the local temp
+    # directory rather than next to the cache, which may be on NFS.
+    fd, d_name = tempfile.mkstemp(prefix=f"{cmd.path_hash}.", suffix=".d")
+    os.close(fd)
+    d_file = Path(d_name)
+    try:
+        if admission is None:
+            return _compile(cmd, prefix_path, d_file)
+        admission.acquire(expected_kb)
+        try:
+            return _compile(cmd, prefix_path, d_file)
+        except CompilerKilled as e:
+            admission.back_off()
+            killed_at_kb = e.peak_rss_kb
+        finally:
+            admission.release(expected_kb)
+        # Once more, with the machine to itself: if it is killed now, it always will be.
+        expected_kb = max(expected_kb, killed_at_kb)
+        admission.acquire(expected_kb, exclusive=True)
+        try:
+            return _compile(cmd, prefix_path, d_file)
+        finally:
+            admission.release(expected_kb)
+    finally:
+        d_file.unlink(missing_ok=True)
+
+def _compile(cmd: CompileCommand, prefix_path: Path, d_file: Path) -> CompileResult:
     # Determine which compiler we are invoking
     is_clang = is_clang_compiler(cmd.command)
 
@@ -295,16 +1244,25 @@ def run_cmd(cmd: CompileCommand, prefix_path: Path) -> Tuple[Set[str], Set[str]]
     # Its own session, so a timeout can take the whole tree down: a compiler driver
     # spawns cc1/ld of its own, and killing only the process we forked leaves those
     # running with nobody waiting on them.
-    with subprocess.Popen(full_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
-                          text=True, start_new_session=True) as process:
+    IN_FLIGHT.admit(cmd)
+    started = time.monotonic()
+    with (PROFILE.span(cmd.file, "compile"),
+          subprocess.Popen(full_cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                           text=True, start_new_session=True) as process):
+        IN_FLIGHT.add(cmd, process)
         try:
-            _, stderr_data = process.communicate(timeout=COMPILE_TIMEOUT_S)
-        except subprocess.TimeoutExpired:
-            os.killpg(process.pid, signal.SIGKILL)  # session leader, so pid == pgid
-            process.communicate()
-            # Raised, not swallowed: the caller records a result only for targets that
-            # finished, so a timed-out file stays "changed" and is retried next run.
-            raise RuntimeError(f"timed out after {COMPILE_TIMEOUT_S}s: {cmd.file}") from None
+            stderr_data, peak_rss_kb, timed_out = _wait_with_rusage(process)
+        finally:
+            superseded = IN_FLIGHT.remove(process)
+    wall_time_s = time.monotonic() - started
+    if superseded:
+        raise Superseded(cmd.file)
+    if timed_out:
+        # Raised, not swallowed: the caller records a result only for targets that
+        # finished, so a timed-out file stays "changed" and is retried next run.
+        raise RuntimeError(f"timed out after {COMPILE_TIMEOUT_S}s: {cmd.file}")
+    if process.returncode == -signal.SIGKILL:
+        raise CompilerKilled(cmd.file, peak_rss_kb)
 
     # 1. Parse errors
     errors = set()
@@ -315,85 +1273,1564 @@ def run_cmd(cmd: CompileCommand, prefix_path: Path) -> Tuple[Set[str], Set[str]]
         except json.JSONDecodeError:
             pass
 
-    with open(cache_file, "w", encoding="utf8") as outfile:
-        outfile.writelines(errors)
-
     # 2. Parse newly generated dependencies (.d file)
-    filtered_deps = parse_dependency_file(d_file, prefix_path)
+    inputs = parse_dependency_file(d_file, Path("/"))
+    prefix = str(prefix_path)
+    filtered_deps = {d for d in inputs if is_under(d, prefix)}
 
-    return errors, filtered_deps
+    return CompileResult(errors, filtered_deps, wall_time_s, peak_rss_kb, inputs)
+
+
+def _wait_with_rusage(process: subprocess.Popen) -> Tuple[str, int, bool]:
+    """Read a compiler's stderr and reap it: (stderr, peak RSS in KiB, timed out).
+
+    communicate() reaps with waitpid, which throws the resource usage away; wait4
+    keeps it. Its ru_maxrss covers the children the driver waited for, so it is the
+    cc1plus peak and not the driver's.
+    """
+    chunks = []
+    reader = threading.Thread(target=lambda: chunks.append(process.stderr.read()), daemon=True)
+    reader.start()
+    reader.join(COMPILE_TIMEOUT_S)
+    timed_out = reader.is_alive()
+    if timed_out:
+        os.killpg(process.pid, signal.SIGKILL)  # session leader, so pid == pgid
+        reader.join()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    peak_rss_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    return "".join(chunks), peak_rss_kb, timed_out
+
+
+def leading_system_includes(file: str) -> List[str]:
+    """The <...> includes `file` starts with, in order, up to its first other line.
+
+    Only system and third-party headers go into a precompiled header: they are the
+    expensive ones, they do not change under the user, and their warnings are not
+    reported anyway. A source using C++20 modules gets none: a PCH cannot precede
+    its global module fragment.
+    """
+    includes = []
+    try:
+        with open(file, "r", encoding="utf8", errors="replace") as f:
+            for line in f:
+                if MODULE_LINE_RE.match(line):
+                    return []
+                if m := SYSTEM_INCLUDE_RE.match(line):
+                    includes.append(m.group(1))
+                elif not SKIPPABLE_LINE_RE.match(line):
+                    break
+    except OSError:
+        return []
+    return includes
+
+
+def flags_key(cmd: CompileCommand) -> Tuple[str, ...]:
+    """The command with the source left out: targets with the same key compile alike."""
+    source = os.path.abspath(cmd.file)
+    return tuple(arg for arg in cmd.command
+                 if arg.startswith("-") or os.path.abspath(arg) != source)
+
+
+class PrecompiledHeader:
+    """A PCH of the includes a group of alike-compiled targets all start with.
+
+    The header, its PCH and a manifest of everything the PCH was built from, with
+    content hashes, live in PCH_FOLDER under a name derived from the flags and the
+    includes. A PCH whose manifest still matches is reused as is, across runs; one
+    that does not is rebuilt by the first target that needs it, while the others in
+    its group wait. A PCH that fails to build is not used: its targets compile the
+    usual way.
+
+    gcc is given `-include group.h`: it picks up group.h.gch next to it, and if that
+    turns out unusable quietly reads the header instead. clang needs -include-pch,
+    and a stale PCH is a hard error there; the caller recompiles without it then.
+    """
+
+    def __init__(self, flags: Tuple[str, ...], includes: List[str], language: str):
+        self.flags = flags
+        self.includes = includes
+        self.language = language
+        self.is_clang = is_clang_compiler(list(flags))
+        key = hashlib.blake2b(repr((flags, includes, language)).encode(), digest_size=16)
+        self.header = (PCH_FOLDER / f"{key.hexdigest()}.h").resolve()
+        self.output = self.header.with_name(self.header.name + (".pch" if self.is_clang
+                                                                else ".gch"))
+        self.manifest = self.header.with_suffix(".json")
+        # Everything the PCH was built from, system headers included
+        self.deps: Set[str] = set()
+        self._ready: Optional[bool] = None
+        self._lock = threading.Lock()
+
+    def ensure(self, admission: Optional["AdmissionController"], expected_kb: int) -> bool:
+        """Make sure the PCH is built and current; False if it cannot be used."""
+        with self._lock:
+            if self._ready is None:
+                current = self._is_current()
+                PROFILE.count("pch hit" if current else "pch miss")
+                self._ready = current or self._build(admission, expected_kb)
+            return self._ready
+
+    def _is_current(self) -> bool:
+        try:
+            with open(self.manifest, "r", encoding="utf8") as infile:
+                hashes = json.load(infile)
+        except (OSError, ValueError):
+            return False
+        if any(get_file_content_hash(f) != h for f, h in hashes.items()):
+            return False
+        self.deps = set(hashes) - {str(self.output)}
+        return True
+
+    def _build(self, admission: Optional["AdmissionController"], expected_kb: int) -> bool:
+        PCH_FOLDER.mkdir(parents=True, exist_ok=True)
+        self.header.write_text("".join(f"#include <{i}>\n" for i in self.includes),
+                               encoding="utf8")
+        d_file = self.header.with_suffix(".d")
+        flags = [f for f in self.flags if f not in ("-fsyntax-only", "-c")]
+        compiler, rest = split_compiler(flags)
+        build = compiler + rest + ["-x", f"{self.language}-header", str(self.header),
+                                   "-o", str(self.output), "-MD", "-MF", str(d_file)]
+        if admission is not None:
+            admission.acquire(expected_kb)
+        try:
+            result = subprocess.run(build, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                    timeout=COMPILE_TIMEOUT_S, start_new_session=True)
+            deps = parse_dependency_file(d_file, Path("/"))
+        except (OSError, subprocess.SubprocessError):
+            return False
+        finally:
+            if admission is not None:
+                admission.release(expected_kb)
+            d_file.unlink(missing_ok=True)
+        if result.returncode != 0:
+            self.output.unlink(missing_ok=True)
+            self.manifest.unlink(missing_ok=True)
+            return False
+        deps.discard(str(self.header))
+        # The PCH itself too: a damaged one is rebuilt rather than quietly ignored by gcc
+        hashes = {f: get_file_content_hash(f) for f in deps | {str(self.output)}}
+        tmp = self.manifest.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf8") as outfile:
+            json.dump(hashes, outfile)
+        os.replace(tmp, self.manifest)
+        self.deps = deps
+        return True
+
+    def command_for(self, cmd: CompileCommand) -> CompileCommand:
+        """`cmd`, compiling with this PCH in front of its own includes."""
+        compiler, rest = split_compiler(cmd.command)
+        use = ["-include-pch", str(self.output)] if self.is_clang else ["-include", str(self.header)]
+        return replace(cmd, command=compiler + use + rest)
+
+    def rejected(self, result: CompileResult) -> bool:
+        """Whether a compile failed on the PCH itself rather than on the target."""
+        pch_files = (str(self.header), str(self.output))
+        return any(d.file in pch_files or "precompiled" in d.message for d in result.errors)
+
+
+def plan_precompiled_headers(files: List[str],
+                             cmds: Dict[str, CompileCommand]) -> Dict[str, PrecompiledHeader]:
+    """The PCH each of `files` is to compile with, for those that share one.
+
+    Targets are grouped by their command minus the source; a group of two or more
+    gets a PCH of the longest run of <...> includes all its sources start with.
+    """
+    groups: Dict[Tuple[Tuple[str, ...], str], List[str]] = {}
+    for f in files:
+        cmd = cmds[f]
+        if cmd.unity_sources:
+            continue
+        language = "c" if Path(f).suffix == ".c" else "c++"
+        groups.setdefault((flags_key(cmd), language), []).append(f)
+
+    plan = {}
+    for (flags, language), members in groups.items():
+        if len(members) < 2:
+            continue
+        common = None
+        for f in members:
+            includes = leading_system_includes(f)
+            if common is None:
+                common = includes
+            else:
+                n = 0
+                while n < min(len(common), len(includes)) and common[n] == includes[n]:
+                    n += 1
+                common = common[:n]
+            if not common:
+                break
+        if common:
+            pch = PrecompiledHeader(flags, common, language)
+            plan.update(dict.fromkeys(members, pch))
+    return plan
+
+
+def run_with_pch(cmd: CompileCommand, prefix_path: Path, pch: PrecompiledHeader,
+                 admission: Optional["AdmissionController"] = None,
+                 expected_kb: int = DEFAULT_EXPECTED_RSS_KB) -> CompileResult:
+    """run_cmd with a shared PCH, falling back to a plain compile if it is unusable.
+
+    The target depends on what went into the PCH as much as on its own includes, so
+    the PCH's dependencies under the prefix are added to its own.
+    """
+    if not pch.ensure(admission, expected_kb):
+        return run_cmd(cmd, prefix_path, admission, expected_kb)
+    result = run_cmd(pch.command_for(cmd), prefix_path, admission, expected_kb)
+    if pch.rejected(result):
+        return run_cmd(cmd, prefix_path, admission, expected_kb)
+    result.header_deps -= {str(pch.header), str(pch.output)}
+    result.header_deps |= {d for d in pch.deps if is_under(d, str(prefix_path))}
+    result.inputs = (result.inputs - {str(pch.header), str(pch.output)}) | pch.deps
+    return result
+
+
+def plan_batches(order: List[str], cmds: Dict[str, CompileCommand], state: State,
+                 reasons: Dict[str, List[str]], size: int) -> List[List[str]]:
+    """Split off from `order` the targets to check `size` at a time, in batches.
+
+    Batches are made of targets with the same command minus the source, that last
+    compiled in under BATCH_MAX_WALL_S, or never did. Targets whose own source was
+    edited stay out: one of those is the likeliest to have errors, which would cost
+    its batch a split, and the user is waiting for it.
+    """
+    groups: Dict[Tuple[Tuple[str, ...], str], List[str]] = {}
+    for f in order:
+        cmd = cmds[f]
+        target = state.targets.get(f)
+        if (cmd.unity_sources or reasons.get(f) == ["source"] or '"' in f or "\\" in f
+                or (target and target.wall_time_s > BATCH_MAX_WALL_S)):
+            continue
+        language = "c" if Path(f).suffix == ".c" else "c++"
+        groups.setdefault((flags_key(cmd), language), []).append(f)
+    batches = []
+    for members in groups.values():
+        for i in range(0, len(members), size):
+            if len(members[i:i + size]) > 1:
+                batches.append(members[i:i + size])
+    return batches
+
+
+def run_batch(batch: List[CompileCommand], prefix_path: Path,
+              admission: Optional["AdmissionController"] = None,
+              expected_kb: int = DEFAULT_EXPECTED_RSS_KB) -> Dict[str, CompileResult]:
+    """Check `batch` in one compiler process, through a synthetic Unity wrapper.
+
+    A clean batch means clean members, each depending on every header the batch read:
+    which member read which is not known, so a change to any dirties them all. Any
+    error, or a batch that fails outright, and it is split in two and each half
+    checked again, down to single targets -- errors in a Unity build are not always
+    the members' own (two statics with one name, a macro leaking into the next file).
+
+    What batching cannot see is an include one member forgot and another, earlier in
+    the wrapper, made for it.
+    """
+    if len(batch) == 1:
+        return {batch[0].file: run_cmd(batch[0], prefix_path, admission, expected_kb)}
+
+    first = batch[0]
+    fd, name = tempfile.mkstemp(prefix="batch.", suffix=Path(first.file).suffix)
+    with os.fdopen(fd, "w", encoding="utf8") as wrapper_file:
+        wrapper_file.writelines(f'#include "{os.path.abspath(c.file)}"\n' for c in batch)
+    wrapper = CompileCommand(file=name, command=list(flags_key(first)) + [name])
+    try:
+        result = run_cmd(wrapper, prefix_path, admission, expected_kb)
+    except Exception:
+        result = None
+    finally:
+        os.unlink(name)
+
+    if result is None or result.errors:
+        half = len(batch) // 2
+        return (run_batch(batch[:half], prefix_path, admission, expected_kb)
+                | run_batch(batch[half:], prefix_path, admission, expected_kb))
+
+    members = {str(Path(c.file).resolve()) for c in batch}
+    deps = result.header_deps - members
+    share = result.wall_time_s / len(batch)
+    return {c.file: CompileResult(set(), set(deps), share, result.peak_rss_kb, set(result.inputs))
+            for c in batch}
+
+
+def result_to_message(result: CompileResult) -> Dict:
+    return {"e": [asdict(d) for d in result.errors], "d": sorted(result.header_deps),
+            "w": result.wall_time_s, "m": result.peak_rss_kb, "i": sorted(result.inputs)}
+
+
+def result_from_message(message: Dict) -> CompileResult:
+    return CompileResult({Diagnostic(**d) for d in message["e"]}, set(message["d"]),
+                         message["w"], message["m"], set(message["i"]))
+
+
+_COMPILER_IDENTITIES: Dict[str, str] = {}
+
+def compiler_identity(command: List[str]) -> str:
+    """What the compiler is, not where: its name and the content of its binary.
+
+    Launchers are left out, ccache and all: they do not change what is reported.
+    """
+    compiler = split_compiler(command)[0][-1]
+    if compiler not in _COMPILER_IDENTITIES:
+        resolved = shutil.which(compiler)
+        digest = get_file_content_hash(os.path.realpath(resolved)) if resolved else ""
+        _COMPILER_IDENTITIES[compiler] = f"{Path(compiler).name}:{digest}"
+    return _COMPILER_IDENTITIES[compiler]
+
+
+class ResultCache:
+    """Compile results by content, shared across checkouts, users and hosts.
+
+    Looked up the way ccache's direct mode does. The compiler's identity, the command
+    minus its source, the source's path and the sources' content key a manifest; the
+    manifest holds the last few results seen for that key, each with the content hash
+    of every file that compile read. The first result whose files all still match is
+    the answer. The path is needed: the same source in another directory finds its
+    "..." includes there, and the files an entry lists are its writer's.
+
+    Paths under the base directory (the checkout) are stored relative to it, in the
+    command, the file lists and the diagnostics, so a second worktree, a teammate's
+    clone or a CI run hits on what any of the others compiled. System headers are not
+    in the compiler's dependency output and are vouched for by its identity alone.
+    Each manifest is written whole and renamed into place, so any number of
+    processes, on any number of hosts, can share a folder; one racing another may
+    lose an entry, never corrupt one.
+    """
+
+    MAX_ENTRIES = 8
+
+    def __init__(self, folder: Path, base: str):
+        self.folder = folder
+        # The base as written and as resolved: commands use one, dependency files the other
+        self._bases = sorted({os.path.abspath(base) + os.sep, os.path.realpath(base) + os.sep},
+                             key=len, reverse=True)
+        self._base = os.path.realpath(base)
+
+    def _rel(self, path: str) -> str:
+        for base in self._bases:
+            path = path.replace(base, "<base>/")
+        return path
+
+    def _abs(self, path: str) -> str:
+        if path.startswith("<base>/"):
+            return os.path.join(self._base, path.removeprefix("<base>/"))
+        return path
+
+    def _manifest(self, cmd: CompileCommand) -> Path:
+        flags = [self._rel(arg) for arg in flags_key(cmd)]
+        key = hashlib.blake2b(json.dumps([compiler_identity(cmd.command), flags,
+                                          self._rel(os.path.abspath(cmd.file)),
+                                          cmd.content_hash]).encode(),
+                              digest_size=20).hexdigest()
+        return self.folder / key[:2] / f"{key}.json"
+
+    def _load(self, path: Path) -> List[Dict]:
+        try:
+            with open(path, "r", encoding="utf8") as infile:
+                return json.load(infile)
+        except (OSError, ValueError):
+            return []
+
+    def get(self, cmd: CompileCommand) -> Optional[CompileResult]:
+        for entry in self._load(self._manifest(cmd)):
+            if all(get_file_content_hash(self._abs(f)) == h for f, h in entry["h"].items()):
+                errors = {replace(Diagnostic(**d), file=self._abs(d["file"])) for d in entry["e"]}
+                return CompileResult(errors, {self._abs(d) for d in entry["d"]}, entry["w"],
+                                     entry["m"], {self._abs(f) for f in entry["h"]})
+        return None
+
+    def put(self, cmd: CompileCommand, result: CompileResult) -> None:
+        # A file changed while it was being compiled may not be what the compiler
+        # read: hashed now, it would vouch for a result it did not produce.
+        started_ns = time.time_ns() - int((result.wall_time_s + 1) * 1e9)
+        for f in [*result.inputs, *cmd.sources]:
+            st = _stat_or_none(f)
+            if st is None or st.st_mtime_ns >= started_ns:
+                return
+        entry = {"h": {self._rel(f): get_file_content_hash(f) for f in result.inputs},
+                 "e": [asdict(replace(d, file=self._rel(d.file))) for d in result.errors],
+                 "d": sorted(self._rel(d) for d in result.header_deps),
+                 "w": result.wall_time_s, "m": result.peak_rss_kb}
+        path = self._manifest(cmd)
+        entries = [e for e in self._load(path) if e["h"] != entry["h"]]
+        entries = [entry, *entries][:self.MAX_ENTRIES]
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf8") as outfile:
+                json.dump(entries, outfile)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+
+def serve_worker() -> int:
+    """--serve-worker: compile what each line of stdin asks for, answering on stdout.
+
+    The worker sees the sources at the paths the client does -- a shared filesystem,
+    as with any checkout on NFS -- and hashes them itself, so its result cache is
+    right whichever client asked first.
+    """
+    for line in sys.stdin:
+        try:
+            request = json.loads(line)
+            os.chdir(request["cwd"])
+            cache = ResultCache(WORKER_RESULT_CACHE, request["cwd"])
+            cmd = CompileCommand(file=request["file"], command=request["command"],
+                                 unity_sources=request["unity"])
+            cmd.content_hash = get_combined_content_hash(cmd.sources)
+            result = cache.get(cmd)
+            if result is None:
+                result = run_cmd(cmd, Path(request["prefix"]))
+                cache.put(cmd, result)
+            reply = result_to_message(result)
+        except Exception as e:
+            reply = {"error": str(e)}
+        sys.stdout.write(json.dumps(reply) + "\n")
+        sys.stdout.flush()
+    return 0
+
+
+class WorkerGone(Exception):
+    pass
+
+
+class WorkerChannel:
+    """A --serve-worker process, run locally or over ssh, doing one compile at a time."""
+
+    def __init__(self, host: str):
+        self.host = host
+        script = Path(__file__).resolve()
+        if host == "local":
+            argv = [sys.executable, str(script), "--serve-worker"]
+        else:
+            # The same dotfiles on the other end, under that user's home
+            home = Path.home()
+            remote = (f"~/{shlex.quote(str(script.relative_to(home)))}"
+                      if script.is_relative_to(home) else shlex.quote(str(script)))
+            argv = ["ssh", *SSH_OPTIONS, host, f"{remote} --serve-worker"]
+        self.process = subprocess.Popen(argv, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL, text=True,
+                                        start_new_session=True)
+
+    def run(self, cmd: CompileCommand, prefix_path: Path) -> CompileResult:
+        request = {"cwd": os.getcwd(), "file": cmd.file, "command": cmd.command,
+                   "unity": cmd.unity_sources, "prefix": str(prefix_path)}
+        try:
+            with PROFILE.span(cmd.file, "compile", host=self.host):
+                self.process.stdin.write(json.dumps(request) + "\n")
+                self.process.stdin.flush()
+                line = self.process.stdout.readline()
+        except (OSError, ValueError) as e:
+            raise WorkerGone(self.host) from e
+        if not line:
+            raise WorkerGone(self.host)
+        reply = json.loads(line)
+        if "error" in reply:
+            raise RuntimeError(f"{self.host}: {reply['error']}")
+        return result_from_message(reply)
+
+    def close(self) -> None:
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+
+
+class Executor:
+    """Where compiles run: -j slots on this machine, plus one per worker process.
+
+    Workers are given as HOST[:SLOTS]: SLOTS worker processes on HOST, all over one
+    multiplexed ssh connection, or on this machine for the host "local". A compile
+    takes a free worker if there is one, else a local slot: the machine the user
+    sits at is the last one filled. A worker that goes away is dropped, and what it
+    was running goes to the next free slot. Batches and PCH builds rely on files in
+    this machine's temp and cache folders, so they only ever take local slots. With
+    -j 0, once no slot of either kind can ever come free -- every worker gone, or
+    local work with none allowed -- one local slot is made rather than wait forever.
+
+    With a shared cache, a compile found there takes no slot at all, and every
+    compile that finishes goes into it.
+    """
+
+    def __init__(self, jobs: int, workers: List[str], shared_cache: Optional[str] = None):
+        channels = []
+        for spec in workers:
+            host, sep, slots = spec.rpartition(":")
+            if not (sep and slots.isdigit()):
+                host, slots = spec, "1"
+            channels += [WorkerChannel(host) for _ in range(int(slots))]
+        self.capacity = jobs + len(channels)
+        self._channels = channels
+        self._free = list(reversed(channels))
+        self._live = len(channels)
+        self._jobs = jobs
+        self._local = jobs
+        self._cond = threading.Condition()
+        self._shared_cache = Path(shared_cache) if shared_cache else None
+        self.cache_hits = 0
+
+    def _acquire(self, remote: bool) -> Optional[WorkerChannel]:
+        with self._cond:
+            while not (remote and self._free) and self._local == 0:
+                if self._jobs == 0 and not (remote and self._live):
+                    print("[INFO] No worker left to compile on, and -j 0: compiling here, "
+                          "one at a time", file=sys.stderr)
+                    self._jobs = self._local = 1
+                    break
+                self._cond.wait()
+            if remote and self._free:
+                return self._free.pop()
+            self._local -= 1
+            return None
+
+    def _release(self, channel: Optional[WorkerChannel], gone: bool = False) -> None:
+        with self._cond:
+            if channel is None:
+                self._local += 1
+            elif gone:
+                self._live -= 1
+                channel.close()
+            else:
+                self._free.append(channel)
+            self._cond.notify_all()
+
+    def run(self, cmd: CompileCommand, prefix_path: Path,
+            admission: Optional[AdmissionController] = None,
+            expected_kb: int = DEFAULT_EXPECTED_RSS_KB) -> CompileResult:
+        if self._shared_cache is None:
+            return self._compile(cmd, prefix_path, admission, expected_kb)
+        cache = ResultCache(self._shared_cache, os.getcwd())
+        result = cache.get(cmd)
+        PROFILE.count("result cache hit" if result is not None else "result cache miss")
+        if result is not None:
+            with self._cond:
+                self.cache_hits += 1
+            return result
+        result = self._compile(cmd, prefix_path, admission, expected_kb)
+        cache.put(cmd, result)
+        return result
+
+    def _compile(self, cmd: CompileCommand, prefix_path: Path,
+                 admission: Optional[AdmissionController], expected_kb: int) -> CompileResult:
+        while True:
+            channel = self._acquire(remote=True)
+            if channel is None:
+                return self._run_local_slot(run_cmd, cmd, prefix_path, admission, expected_kb)
+            gone = False
+            try:
+                return channel.run(cmd, prefix_path)
+            except WorkerGone:
+                gone = True
+            finally:
+                self._release(channel, gone)
+
+    def run_local(self, fn, *args):
+        """`fn(*args)`, in a local slot."""
+        self._acquire(remote=False)
+        return self._run_local_slot(fn, *args)
+
+    def _run_local_slot(self, fn, *args):
+        try:
+            return fn(*args)
+        finally:
+            self._release(None)
+
+    def close(self) -> None:
+        for channel in self._channels:
+            channel.close()
 
-def load_or_initialize_state(ignore_cache: bool = False) -> State:
-    """Last run's state, or an empty one.
 
-    Anything unreadable is treated as absent rather than fatal -- a truncated file, or
-    one written by an older schema, costs a full re-analysis and nothing worse.
+class DiagnosticsStore:
+    """Every target's last errors, in one file, keyed by path hash.
+
+    It used to be an .errors and a .d file per target: tens of thousands of tiny
+    files, slow to open over NFS and never cleaned up. Now it is one append-only file
+    of {"k": path hash, "t": target, "e": [errors]} lines, read into memory once (only
+    targets with errors have an entry, so it stays small) and rewritten without the
+    superseded lines once they are most of it. A target without an entry is clean.
     """
-    if (not ignore_cache) and ERRORS_STATE_FILE.exists():
+
+    def __init__(self):
+        self._errors: Dict[PathHash, Tuple[str, Set[Diagnostic]]] = {}
+        self._lines = 0
+        self._fd: Optional[int] = None
+
+    def load(self) -> None:
+        self._errors, self._lines = {}, 0
         try:
-            with open(ERRORS_STATE_FILE, "r", encoding="utf8") as infile:
-                return State.from_dict(json.load(infile))
-        except (json.JSONDecodeError, OSError, TypeError, KeyError, AttributeError):
+            with open(DIAGNOSTICS_FILE, "r", encoding="utf8") as infile:
+                for line in infile:
+                    try:
+                        entry = json.loads(line)
+                        errors = {Diagnostic(**d) for d in entry["e"]}
+                    except (ValueError, KeyError, TypeError):
+                        break  # a torn last line
+                    self._lines += 1
+                    if errors:
+                        self._errors[entry["k"]] = (entry["t"], errors)
+                    else:
+                        self._errors.pop(entry["k"], None)
+        except FileNotFoundError:
+            self._import_legacy()
+        except OSError:
             pass
-    return State(targets={}, unique_deps={})
+
+    def get(self, path_hash: PathHash) -> Set[Diagnostic]:
+        return self._errors.get(path_hash, ("", set()))[1]
+
+    def files(self) -> Set[str]:
+        """Every file a stored error is in, resolved as the dependencies are. A relative
+        one is relative to where it was compiled: here, as compiles run in this
+        directory, and workers change to it first."""
+        return {os.path.realpath(d.file) for _, errors in self._errors.values() for d in errors}
+
+    def put(self, path_hash: PathHash, target: str, errors: Set[Diagnostic]) -> None:
+        if errors == self.get(path_hash):
+            return
+        if errors:
+            self._errors[path_hash] = (target, errors)
+        else:
+            del self._errors[path_hash]
+        self._append(path_hash, target, errors)
+
+    def evict(self, live: Set[PathHash]) -> int:
+        """Drop the entries of targets not in `live`; returns how many went."""
+        gone = [k for k in self._errors if k not in live]
+        for k in gone:
+            self.put(k, self._errors[k][0], set())
+        return len(gone)
+
+    def compact(self, force: bool = False) -> None:
+        """Rewrite the file with only live entries, once superseded lines dominate."""
+        if not force and self._lines <= 2 * len(self._errors) + 1024:
+            return
+        self.close()
+        tmp = DIAGNOSTICS_FILE.with_suffix(".jsonl.tmp")
+        with open(tmp, "w", encoding="utf8") as outfile:
+            for k, (target, errors) in self._errors.items():
+                outfile.write(self._line(k, target, errors))
+        os.replace(tmp, DIAGNOSTICS_FILE)
+        self._lines = len(self._errors)
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+    @staticmethod
+    def _line(path_hash: PathHash, target: str, errors: Set[Diagnostic]) -> str:
+        return json.dumps({"k": path_hash, "t": target,
+                           "e": [asdict(d) for d in errors]}, separators=(",", ":")) + "\n"
+
+    def _append(self, path_hash: PathHash, target: str, errors: Set[Diagnostic]) -> None:
+        if self._fd is None:
+            self._fd = os.open(DIAGNOSTICS_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(self._fd, self._line(path_hash, target, errors).encode())
+        self._lines += 1
+
+    def _import_legacy(self) -> None:
+        """Fold the per-target .errors files older versions wrote into the store."""
+        for cache_file in ERRORS_CACHE_FOLDER.glob("*.errors"):
+            try:
+                with open(cache_file, "r", encoding="utf8") as infile:
+                    errors = {Diagnostic.from_cache_line(line) for line in infile if line.strip()}
+            except OSError:
+                continue
+            if errors:
+                self.put(cache_file.stem, "", errors)
+
+
+def remove_legacy_cache_files() -> int:
+    """Delete the per-target files older versions left in the cache folder."""
+    removed = 0
+    for pattern in ("*.errors", "*.d", "*.tmp"):
+        for leftover in ERRORS_CACHE_FOLDER.glob(pattern):
+            leftover.unlink(missing_ok=True)
+            removed += 1
+    return removed
+
+
+def all_compile_command_files(compile_commands_path: str) -> Set[str]:
+    """Every file compile_commands.json compiles, whatever its prefix."""
+    return {c["file"] for c in iter_compile_commands(compile_commands_path)}
+
+
+def collect_garbage(session: "Session", args, err: TextIO) -> None:
+    """--gc: forget every target compile_commands.json no longer has, then compact."""
+    state = session.state
+    listed = all_compile_command_files(args.compile_commands)
+    gone = [k for k in state.targets if k not in listed or not os.path.exists(k)]
+    for k in gone:
+        state.remove_target(k)
+    live = {t.path_hash for t in state.targets.values()}
+    evicted = session.store.evict(live)
+    session.store.compact(force=True)
+    save_state(state)
+    STATE_JOURNAL.unlink(missing_ok=True)
+    removed = remove_legacy_cache_files()
+    # PCHs are rebuilt on demand, and their names say nothing about who still uses them
+    if PCH_FOLDER.exists():
+        removed += sum(1 for _ in PCH_FOLDER.iterdir())
+        shutil.rmtree(PCH_FOLDER, ignore_errors=True)
+    print(f"[INFO] Forgot {len(gone)} target(s), dropped {evicted} cached error set(s), "
+          f"deleted {removed} leftover file(s)", file=err)
+
+
+def load_or_initialize_state(ignore_cache: bool = False) -> State:
+    """Last run's state, or an empty one.
+
+    That is the snapshot with the journal replayed over it. Anything unreadable is
+    treated as absent rather than fatal -- a truncated file, or one written by an older
+    schema, costs a full re-analysis and nothing worse. The JSON file versions before
+    the binary one wrote is read once, then replaced by the next save.
+    """
+    if ignore_cache:
+        return State(targets={}, unique_deps={})
+    state = None
+    try:
+        if ERRORS_STATE_FILE.exists():
+            state = State.from_snapshot(StateSnapshot(ERRORS_STATE_FILE))
+        elif LEGACY_STATE_FILE.exists():
+            with open(LEGACY_STATE_FILE, "r", encoding="utf8") as infile:
+                state = State.from_dict(json.load(infile))
+    except (ValueError, OSError, TypeError, KeyError, AttributeError, IndexError, struct.error):
+        pass
+    state = state or State(targets={}, unique_deps={})
+    replay_journal(state)
+    return state
 
 
 def save_state(state: State) -> None:
-    """Write the state file atomically, so an interrupted run cannot truncate it."""
-    tmp = ERRORS_STATE_FILE.with_suffix(".json.tmp")
-    with open(tmp, "w", encoding="utf8") as outfile:
-        json.dump(asdict(state), outfile, indent=2, default=json_set_to_list)
+    """Write the state file atomically, so an interrupted run cannot truncate it.
+
+    Dependency lists nobody decoded since the load are copied across as they are. Once
+    the path table is mostly paths nothing refers to any more, everything is decoded
+    and the table rebuilt from scratch.
+    """
+    if len(state.table.paths) > 2 * (len(state.targets) + len(state.unique_deps)) + 1024:
+        state.load_all()
+        state.table = PathTable()
+    table = state.table
+
+    targets, deps = bytearray(), bytearray()
+    for k, t in state.targets.items():
+        raw = t.raw_deps()
+        chunk = (raw[0].deps[raw[1]:raw[1] + raw[2]].tobytes() if raw
+                 else _pack_ids(table, t.header_deps))
+        targets += TARGET_RECORD.pack(table.intern(k), bytes.fromhex(t.content_hash),
+                                      bytes.fromhex(t.path_hash), len(deps) // 4, len(chunk) // 4,
+                                      t.wall_time_s, t.peak_rss_kb)
+        deps += chunk
+
+    headers, users = bytearray(), bytearray()
+    # Every header with a hash or with dependents: one without the other still counts.
+    known = dict.fromkeys(state.unique_deps) | dict.fromkeys(state.dependents)
+    for h in known:
+        raw = state.dependents.raw(h)
+        chunk = (raw[0].users[raw[1]:raw[1] + raw[2]].tobytes() if raw
+                 else _pack_ids(table, state.dependents.get(h, set())))
+        headers += HEADER_RECORD.pack(table.intern(h), bytes.fromhex(state.unique_deps.get(h, "")),
+                                      len(users) // 4, len(chunk) // 4,
+                                      bytes.fromhex(state.token_hashes.get(h, "")))
+        users += chunk
+
+    blob = "\0".join(table.paths).encode("utf8", "surrogateescape")
+    header = STATE_HEADER.pack(STATE_MAGIC, STATE_VERSION, len(table.paths), len(state.targets),
+                               len(known), len(blob), len(deps) // 4, len(users) // 4)
+    padding = b"\0" * (_align(len(header) + len(blob)) - len(header) - len(blob))
+
+    tmp = ERRORS_STATE_FILE.with_suffix(".bin.tmp")
+    with open(tmp, "wb") as outfile:
+        for part in (header, blob, padding, targets, headers, deps, users):
+            outfile.write(part)
     os.replace(tmp, ERRORS_STATE_FILE)
+    LEGACY_STATE_FILE.unlink(missing_ok=True)
+
+class StateJournal:
+    """Per-target updates, appended to STATE_JOURNAL as each target finishes.
+
+    The snapshot is only rewritten by compact_state, so a run that rebuilt three
+    targets writes three lines, and a run cut short keeps everything it finished.
+    """
+
+    def __init__(self):
+        self._fd = os.open(STATE_JOURNAL, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def append(self, update: Dict) -> None:
+        # One write per line: a run killed mid-write leaves at most a torn last line.
+        os.write(self._fd, (json.dumps(update, separators=(",", ":")) + "\n").encode())
+
+    def close(self) -> None:
+        os.close(self._fd)
+
+
+def target_update(state: State, cmd: CompileCommand, result: CompileResult,
+                  header_hash_cache: Dict[str, str]) -> Dict:
+    """A journal entry for a freshly analyzed target.
+
+    Keys are short, since there is one line per target per run: the target, its
+    content and path hashes, its compile's wall time and peak RSS, its dependencies,
+    and the content and token hashes of those dependencies the state does not
+    already have. Token hashes are not made here, only passed on from the cut-off
+    checks that made them: a header gets one once it has changed under a target.
+    """
+    hashes, tokens = {}, {}
+    for dep in result.header_deps:
+        if dep not in header_hash_cache:
+            header_hash_cache[dep] = get_file_content_hash(dep)
+        if state.unique_deps.get(dep) != header_hash_cache[dep]:
+            hashes[dep] = header_hash_cache[dep]
+            tokens[dep] = _TOKEN_HASHES.get(hashes[dep], "")
+    return {"t": cmd.file, "c": cmd.content_hash, "p": cmd.path_hash,
+            "w": round(result.wall_time_s, 3), "m": result.peak_rss_kb,
+            "d": sorted(result.header_deps), "h": hashes, "k": tokens}
+
+
+def apply_update(state: State, update: Dict) -> None:
+    """Apply a journal entry. Entries are absolute, so applying one twice is harmless.
+
+    One without a target records headers whose change get_needs_recompile cut off.
+    """
+    if "t" not in update:
+        state.unique_deps.update(update["h"])
+        return
+    file = update["t"]
+    if update.get("x"):
+        if file in state.targets:
+            state.remove_target(file)
+        return
+    if file not in state.targets:
+        state.targets[file] = TargetFile(set(), "", "")
+    state.targets[file].content_hash = update["c"]
+    state.targets[file].path_hash = update["p"]
+    if "w" in update:
+        state.targets[file].wall_time_s = update["w"]
+    if "m" in update:
+        state.targets[file].peak_rss_kb = update["m"]
+    if "d" in update:
+        state.set_header_deps(file, set(update["d"]))
+        state.unique_deps.update(update["h"])
+        for dep, digest in update.get("k", {}).items():
+            if digest:
+                state.token_hashes[dep] = digest
+            else:
+                state.token_hashes.pop(dep, None)
+
+
+def replay_journal(state: State) -> None:
+    """Apply what runs since the last snapshot recorded, stopping at a torn line."""
+    try:
+        with open(STATE_JOURNAL, "r", encoding="utf8") as infile:
+            for line in infile:
+                try:
+                    apply_update(state, json.loads(line))
+                except (ValueError, KeyError, TypeError):
+                    break
+    except OSError:
+        pass
+
+
+def compact_state(state: State) -> None:
+    """Rewrite the snapshot and empty the journal, once the journal is big enough; or
+    at once if there is no snapshot yet, or the JSON state of older versions is still
+    there to replace, whatever this run journaled.
+
+    In that order: killed in between, the journal is replayed over a snapshot that
+    already has it, which changes nothing.
+    """
+    try:
+        journal_size = STATE_JOURNAL.stat().st_size
+    except OSError:
+        journal_size = 0
+    try:
+        snapshot_size = ERRORS_STATE_FILE.stat().st_size
+    except OSError:
+        snapshot_size = None
+    if (snapshot_size is not None and not LEGACY_STATE_FILE.exists()
+            and (journal_size == 0 or journal_size < max(JOURNAL_COMPACT_MIN_BYTES,
+                                                         snapshot_size * JOURNAL_COMPACT_RATIO))):
+        return
+    save_state(state)
+    if journal_size:
+        os.truncate(STATE_JOURNAL, 0)
+
 
 def get_needs_recompile(cmds: Dict[str, CompileCommand], state: State,
-                        header_hash_cache: Dict[str, str]) -> Tuple[Set[str], Set[str], Dict[str, str]]:
+                        header_hash_cache: Dict[str, str], owners: Set[str] = frozenset(),
+                        cut_off: Optional[Dict[str, str]] = None
+                        ) -> Tuple[Set[str], Set[str], Dict[str, List[str]]]:
     """Determine which targets need recompilation using purely state and content hashes.
 
+    Headers are checked once each, not once per target that includes them, and a
+    changed one dirties exactly its dependents -- the work is the number of changed
+    headers times their fan-out, not the size of every target's dependency list.
+
+    Returns (changed, unchanged, reasons), where reasons says why each changed
+    target is: "new", "source", or the headers that changed under it.
+
     `header_hash_cache` comes in warm from prime_header_hashes and is filled in for
     anything it missed, so the caller can reuse it when rewriting unique_deps.
+
+    A header whose token hash did not change -- only its comments or whitespace did
+    -- dirties nothing, and goes in `cut_off` with its new content hash, for the
+    caller to record. Except for the `owners` of stored errors: a line removed from
+    one would leave its errors pointing at the wrong line. Token hashes are made
+    here, for changed headers that would dirty a target not already being rebuilt,
+    and so the first change to a header is never cut off: there is nothing yet to
+    compare it with.
     """
-    changed_files = set()
-    unchanged_files = set()
+    reasons: Dict[str, List[str]] = {}
 
     for k, cmd in cmds.items():
         if k not in state.targets:
-            changed_files.add(k)
-            continue
-            
-        target = state.targets[k]
-        
+            reasons[k] = ["new"]
         # Check if the source file itself changed
-        if target.content_hash != cmd.content_hash:
-            changed_files.add(k)
+        elif state.targets[k].content_hash != cmd.content_hash:
+            reasons[k] = ["source"]
+
+    # Check which known headers changed or were deleted; a deleted one hashes to "".
+    for dep in state.dependents:
+        if dep not in header_hash_cache:
+            header_hash_cache[dep] = get_file_content_hash(dep)
+        current = header_hash_cache[dep]
+        stored = state.unique_deps.get(dep)
+        if current and current == stored:
             continue
-            
-        # Check if any known header dependencies changed or were deleted
-        deps_changed = False
-        for dep in target.header_deps:
-            if not os.path.exists(dep):
-                deps_changed = True
-                break
-                
-            if dep not in header_hash_cache:
-                header_hash_cache[dep] = get_file_content_hash(dep)
-                
-            if header_hash_cache[dep] != state.unique_deps.get(dep):
-                deps_changed = True
-                break
-                
-        if deps_changed:
-            changed_files.add(k)
+        dirtied = [k for k in state.dependents[dep]
+                   if k in cmds and reasons.get(k, [None])[0] not in ("new", "source")]
+        if not dirtied:
+            continue  # a source, or a header only sources being rebuilt include
+        if (current and stored and cut_off is not None and dep not in owners
+                and token_hash(dep, current) == state.token_hashes.get(dep)):
+            cut_off[dep] = current
+            continue
+        for k in dirtied:
+            reasons.setdefault(k, []).append(dep)
+
+    changed_files = set(reasons)
+    unchanged_files = set(cmds) - changed_files
+    return changed_files, unchanged_files, reasons
+
+
+def schedule(changed: Set[str], cmds: Dict[str, CompileCommand], state: State,
+             reasons: Dict[str, List[str]]) -> Tuple[List[str], Dict[str, float]]:
+    """The order to compile `changed` in, and each one's predicted wall time.
+
+    Targets whose own source changed go first, most recently saved first: that is
+    what the user is looking at. The rest go longest first, so the one 90-second
+    template monster starts with everything else rather than after it, alone on one
+    core. A target with no recorded time is guessed at the median of those that have
+    one; with no recorded times at all there is nothing to predict from and the
+    returned prediction is empty.
+    """
+    known = [t.wall_time_s for t in state.targets.values() if t.wall_time_s > 0]
+    guess = statistics.median(known) if known else 0.0
+    predicted = {}
+    if known:
+        for f in changed:
+            target = state.targets.get(f)
+            predicted[f] = target.wall_time_s if target and target.wall_time_s > 0 else guess
+
+    def newest_source(f: str) -> int:
+        mtimes = [st.st_mtime_ns for st in map(_stat_or_none, cmds[f].sources) if st]
+        return max(mtimes, default=0)
+
+    edited = sorted((f for f in changed if reasons.get(f) == ["source"]),
+                    key=newest_source, reverse=True)
+    rest = sorted(changed.difference(edited), key=lambda f: predicted.get(f, 0.0), reverse=True)
+    return edited + rest, predicted
+
+
+def predicted_makespan(order: List[str], predicted: Dict[str, float], jobs: int) -> float:
+    """When the last of `order` would finish on `jobs` workers taking them in order."""
+    workers = [0.0] * max(1, jobs)
+    for f in order:
+        heapq.heapreplace(workers, workers[0] + predicted[f])
+    return max(workers)
+
+
+def _stat_or_none(path: str) -> Optional[os.stat_result]:
+    try:
+        return os.stat(path)
+    except OSError:
+        return None
+
+
+def explain(file: str, session: "Session", reasons: Dict[str, List[str]], out: TextIO,
+            cut_off: Optional[Dict[str, str]] = None) -> None:
+    """Print why `file` -- a target, one of its sources, or a header -- would be rebuilt."""
+    state = session.state
+    path = os.path.realpath(file)
+    targets = sorted(session.targets_of(path))
+    for k in targets:
+        why = reasons.get(k)
+        if why is None:
+            print(f"{k}: up to date", file=out)
+        elif why == ["new"]:
+            print(f"{k}: never analyzed", file=out)
+        elif why == ["source"]:
+            print(f"{k}: its source changed", file=out)
         else:
-            unchanged_files.add(k)
-            
-    return changed_files, unchanged_files, header_hash_cache
+            print(f"{k}: {len(why)} changed header(s)", file=out)
+            for dep in sorted(why):
+                print(f"    {dep}", file=out)
+
+    # A compiler lists the source itself among its dependencies; that is not news.
+    users = sorted(u for u in state.dependents.get(path, ())
+                   if u in session.cmds and u not in targets)
+    if users:
+        if path in (cut_off or {}):
+            status = "changed only in comments or whitespace"
+        else:
+            changed = any(path in reasons.get(u, ()) for u in users)
+            status = "changed" if changed else "unchanged"
+        print(f"{path}: {status}, included by {len(users)} target(s)", file=out)
+        for k in users:
+            print(f"    {k}", file=out)
 
-def json_set_to_list(obj):
-    if isinstance(obj, set):
-        return list(obj)
-    raise TypeError
+    if not targets and not users:
+        print(f"{file}: neither a target under the prefix nor a header one includes", file=out)
 
-if __name__ == "__main__":
+class Session:
+    """Everything a run needs that can outlive it.
+
+    A one-shot run builds one, uses it once and exits. The daemon keeps one for its
+    whole life, so the parsed compile_commands.json, the state and the header hashes
+    are loaded once and only what the watcher saw change is rehashed per request.
+    """
+
+    def __init__(self, state: State, jobs: int, workers: Optional[List[str]] = None,
+                 shared_cache: Optional[str] = None):
+        self.state = state
+        self.executor = Executor(jobs, workers or [], shared_cache)
+        # Every compile slot, this machine's and the workers'
+        self.jobs = self.executor.capacity
+        self.store = DiagnosticsStore()
+        self.store.load()
+        self.cmds: Dict[str, CompileCommand] = {}
+        self.header_hash_cache: Dict[str, str] = {}
+        # Which commands to rehash when a source path changes.
+        self._sources: Dict[str, Set[str]] = {}
+        self._cmds_key: Tuple = ()
+        self._cmds_stamp: Tuple[int, int] = (0, 0)
+        # Paths the watcher saw change since the last run. None means "unknown":
+        # there is no watcher, or it died, so every hash has to be recomputed.
+        self._dirty: Optional[Set[str]] = None
+        self._watched = True
+        # What the watcher covers; a path outside it counts as changed on every run.
+        self._watch_root = os.path.join(os.path.realpath(os.getcwd()), "")
+        self._dirty_lock = threading.Lock()
+        # One analysis at a time: runs share the state and the cache folder.
+        self.run_lock = threading.Lock()
+        # Held to read or change the state and the store, which a --focus request,
+        # not taking run_lock, may do in the middle of a run.
+        self.state_lock = threading.Lock()
+
+    def targets_of(self, path: str) -> Set[str]:
+        """Commands that compile the source at `path` (a real path)."""
+        return set(self._sources.get(path, ()))
+
+    def mark_dirty(self, paths: Optional[List[str]]) -> None:
+        """Record what the watcher saw change; None, that there is no watcher any more,
+        so from now on every run rechecks everything."""
+        with self._dirty_lock:
+            if paths is None:
+                self._dirty, self._watched = None, False
+            elif self._dirty is not None:
+                self._dirty.update(os.path.realpath(p) for p in paths)
+
+    def _take_dirty(self) -> Optional[Set[str]]:
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set() if self._watched else None
+            return dirty
+
+    def load_commands(self, args) -> bool:
+        """Reread compile_commands.json if it, or how it is read, changed; whether it did."""
+        key = (os.path.abspath(args.compile_commands), args.path_prefix, args.cxx, args.cc,
+               tuple(args.analysis_flags))
+        st = os.stat(args.compile_commands)
+        stamp = (st.st_mtime_ns, st.st_size)
+        if key == self._cmds_key and stamp == self._cmds_stamp:
+            return False
+        with PROFILE.span("get_commands_of_interest"):
+            cmds = get_commands_of_interest(args.compile_commands, args.path_prefix,
+                                            args.cxx, args.cc, args.analysis_flags,
+                                            use_cache=not args.no_cache)
+            sources: Dict[str, Set[str]] = {}
+            for k, cmd in cmds.items():
+                for source in cmd.sources:
+                    sources.setdefault(os.path.realpath(source), set()).add(k)
+            self.cmds, self._sources = cmds, sources
+            self._cmds_key, self._cmds_stamp = key, stamp
+        return True
+
+    def refresh(self, args, pool: ThreadPoolExecutor) -> None:
+        """Bring commands and hashes up to date, redoing only what may have changed."""
+        # Taken first: whatever changes while this runs is seen by the next refresh.
+        dirty = self._take_dirty()
+        reloaded = self.load_commands(args)
+        if dirty is not None:
+            dirty.update(path for paths in (self._sources, self.header_hash_cache)
+                         for path in paths if not path.startswith(self._watch_root))
+
+        with PROFILE.span("hash_sources"):
+            if dirty is None or reloaded:
+                hash_sources(self.cmds, pool)
+            else:
+                touched = {k for path in dirty for k in self._sources.get(path, ())}
+                hash_sources({k: self.cmds[k] for k in touched}, pool)
+
+        with PROFILE.span("prime_header_hashes"):
+            if dirty is None:
+                self.header_hash_cache = {}
+            else:
+                for path in dirty:
+                    self.header_hash_cache.pop(path, None)
+            self.header_hash_cache.update(prime_header_hashes(self.state, pool,
+                                                              self.header_hash_cache))
+
+
+def check(session: Session, args, pool: ThreadPoolExecutor, out: TextIO, err: TextIO) -> None:
+    """One analysis pass: print the errors of every target under the prefix."""
+    if args.gc:
+        collect_garbage(session, args, err)
+        return
+    if args.focus:
+        check_focus(session, args, out, err)
+        return
+
+    # A one-shot run started it before loading anything; a daemon request starts it here
+    if args.profile and not PROFILE.enabled:
+        PROFILE.start()
+
+    resolved_prefix = Path(args.path_prefix).resolve()
+    state = session.state
+    RESOLVE_CACHE.clear()
+    # Hashed afresh below: whatever a focus request saw newer, this run sees too
+    IN_FLIGHT.forget()
+
+    session.refresh(args, pool)
+    cmds = session.cmds
+    header_hash_cache = session.header_hash_cache
+
+    # A --focus request may change the state while this runs, but only between the
+    # steps below that hold state_lock.
+    with session.state_lock:
+        # 1. Determine exactly what needs recompilation
+        cut_off: Dict[str, str] = {}
+        with PROFILE.span("get_needs_recompile"):
+            changed_files, unchanged_files, reasons = get_needs_recompile(
+                cmds, state, header_hash_cache, session.store.files(), cut_off)
+        if args.explain:
+            explain(args.explain, session, reasons, out, cut_off)
+            return
+
+        journal = None if args.no_cache else StateJournal()
+
+        # Headers whose change was only to comments or whitespace: their new hashes are
+        # recorded, and nothing that includes them is rebuilt.
+        if cut_off:
+            update = {"h": cut_off}
+            apply_update(state, update)
+            if journal is not None:
+                journal.append(update)
+            PROFILE.count("headers cut off", len(cut_off))
+
+        # Targets under the prefix that compile_commands.json no longer lists are gone:
+        # forget them and their errors. Anything else is left for --gc.
+        prefix = str(resolved_prefix) + os.sep
+        for file in [k for k in state.targets
+                     if k not in cmds and os.path.abspath(k).startswith(prefix)]:
+            session.store.put(state.targets[file].path_hash, file, set())
+            update = {"t": file, "x": True}
+            apply_update(state, update)
+            if journal is not None:
+                journal.append(update)
+
+        # 2. Dispatch compiles to the thread pool; it starts them in submission order
+        with PROFILE.span("schedule"):
+            order, predicted = schedule(changed_files, cmds, state, reasons)
+        compile_phase_begin = time.perf_counter_ns()
+        compiles_started = time.monotonic()
+        admission = AdmissionController()
+        expected = expected_rss_kb(state)
+        hits_before = session.executor.cache_hits
+        batches = plan_batches(order, cmds, state, reasons, args.batch) if args.batch > 1 else []
+        batch_of = {f: batch for batch in batches for f in batch}
+        pchs = (plan_precompiled_headers([f for f in order if f not in batch_of], cmds)
+                if args.pch else {})
+        futures = {}
+        for f in order:
+            if f in batch_of:
+                # Submitted where its first, and longest, member would have gone
+                batch = batch_of[f]
+                if batch[0] == f:
+                    future = pool.submit(session.executor.run_local, run_batch,
+                                         [cmds[m] for m in batch], resolved_prefix, admission,
+                                         max(expected.get(m, expected[""]) for m in batch))
+                    futures[future] = batch
+                continue
+            if f in pchs:
+                future = pool.submit(session.executor.run_local, run_with_pch, cmds[f],
+                                     resolved_prefix, pchs[f], admission,
+                                     expected.get(f, expected[""]))
+            else:
+                future = pool.submit(session.executor.run, cmds[f], resolved_prefix, admission,
+                                     expected.get(f, expected[""]))
+            futures[future] = [f]
+    compiles_done = compiles_started
+
+    printer = DiagnosticPrinter(out, args.format)
+    settled = set()
+    try:
+        # 3. Replay what is known while the compilers start up. Read here rather than
+        # in the pool: thousands of small reads queued behind (or between) compiles
+        # would print known errors last, and hold workers a compile could use.
+        with PROFILE.span("replay cached"):
+            for file in sorted(unchanged_files):
+                printer.emit(session.store.get(cmds[file].path_hash), file, cached=True,
+                             sources=cmds[file].sources)
+
+        # 4. Then the compiles, as they finish
+        for future in as_completed(futures):
+            files = futures[future]
+            compiles_done = time.monotonic()
+            try:
+                result = future.result()
+            except Superseded:
+                continue  # a focus request has it, at its newer hash
+            except Exception as e:
+                print(f"[ERROR] {e}", file=err)
+                # Forget the source hash, so the next run retries this target even if
+                # what dirtied it was a header whose new hash is recorded by another.
+                with session.state_lock:
+                    for file in files:
+                        if file in state.targets:
+                            update = {"t": file, "c": "", "p": cmds[file].path_hash}
+                            apply_update(state, update)
+                            if journal is not None:
+                                journal.append(update)
+                settled.update(files)
+                continue
+
+            results = result if isinstance(result, dict) else {files[0]: result}
+            for file, result in results.items():
+                # Errors first: a target the journal calls up to date must have them stored.
+                with session.state_lock:
+                    session.store.put(cmds[file].path_hash, file, result.errors)
+                    update = target_update(state, cmds[file], result, header_hash_cache)
+                    apply_update(state, update)
+                    if journal is not None:
+                        journal.append(update)
+                    settled.add(file)
+
+                printer.emit(result.errors, file, cached=False, sources=cmds[file].sources)
+    except KeyboardInterrupt:
+        # What finished is in the journal already; what has not started never will.
+        # Forget the source hash of every target without a result, as for a failed
+        # compile: a header that dirtied it may have had its new hash recorded by a
+        # dependent that did finish, and nothing else would bring it back.
+        for future in futures:
+            future.cancel()
+        with session.state_lock:
+            for file in order:
+                if file not in settled and file in state.targets:
+                    update = {"t": file, "c": "", "p": cmds[file].path_hash}
+                    apply_update(state, update)
+                    if journal is not None:
+                        journal.append(update)
+        raise
+    finally:
+        with session.state_lock:
+            session.store.close()
+        if journal is not None:
+            journal.close()
+    PROFILE.add_span("compile", compile_phase_begin)
+    printer.summary(err)
+    if cut_off:
+        print(f"[INFO] {len(cut_off)} header(s) changed only in comments or whitespace; "
+              f"nothing that includes them was rebuilt", file=err)
+
+    if order:
+        estimate = (f"predicted {predicted_makespan(order, predicted, session.jobs):.2f}s"
+                    if predicted else "nothing to predict it from yet")
+        print(f"[INFO] Compiled {len(order)} target(s) in {compiles_done - compiles_started:.2f}s, "
+              f"{estimate}", file=err)
+        if admission.held_back or admission.oom_kills:
+            print(f"[INFO] Held back {admission.held_back} compile(s) for memory or load, "
+                  f"{admission.oom_kills} killed for memory and retried alone", file=err)
+        if session.executor.cache_hits > hits_before:
+            print(f"[INFO] {session.executor.cache_hits - hits_before} result(s) from the shared "
+                  f"cache", file=err)
+
+    # 5. Fold the journals into their snapshots once they have grown enough to be worth it
+    with PROFILE.span("save_state"), session.state_lock:
+        session.store.compact()
+        if journal is not None:
+            compact_state(state)
+            STAT_CACHE.save()
+
+    if PROFILE.enabled:
+        PROFILE.stop()
+        PROFILE.write_trace(PROFILE_TRACE_FILE)
+        PROFILE.report(args.profile, session.jobs, err)
+
+
+def focus_targets(session: Session, files: List[str], err: TextIO) -> List[str]:
+    """The targets that check each of `files`: those compiling it or, for a header, the
+    quickest target that includes it -- one is enough to see the header's errors."""
+    targets: List[str] = []
+    for file in files:
+        path = os.path.realpath(file)
+        found = sorted(session.targets_of(path))
+        if not found:
+            users = [u for u in session.state.dependents.get(path, ()) if u in session.cmds]
+            if users:
+                found = [min(users, key=lambda u: (session.state.targets[u].wall_time_s, u))]
+        if not found:
+            print(f"[INFO] {file}: no target under the prefix compiles or includes it", file=err)
+        targets += [k for k in found if k not in targets]
+    return targets
+
+
+def is_up_to_date(state: State, cmd: CompileCommand) -> bool:
+    """Whether `cmd` was last checked with its sources and headers as they are now."""
+    target = state.targets.get(cmd.file)
+    return (target is not None and target.content_hash == cmd.content_hash
+            and all(get_file_content_hash(d) == state.unique_deps.get(d)
+                    for d in target.header_deps))
+
+
+def check_focus(session: Session, args, out: TextIO, err: TextIO) -> None:
+    """Check just the targets of the --focus files, now, printing each one's errors as
+    soon as it finishes.
+
+    For an editor that has just saved: this neither waits for a run the daemon is in
+    the middle of nor queues behind its compiles. Every target is rehashed on the
+    spot, and a compile of an older version of it -- that run's, or an earlier focus
+    request's -- is killed. What changed compiles straight away, outside -j and
+    admission, since someone is waiting on it; what did not is answered from the store.
+    """
+    started = time.monotonic()
+    resolved_prefix = Path(args.path_prefix).resolve()
+    state = session.state
+    with session.state_lock:
+        # A one-shot run has nothing loaded; a daemon's commands are as of its last run.
+        if not session.cmds:
+            session.load_commands(args)
+        targets = focus_targets(session, args.focus, err)
+        cmds = {k: replace(session.cmds[k],
+                           content_hash=get_combined_content_hash(session.cmds[k].sources))
+                for k in targets}
+        stale = [k for k in targets if not is_up_to_date(state, cmds[k])]
+    for k in stale:
+        IN_FLIGHT.supersede(k, cmds[k].content_hash)
+
+    printer = DiagnosticPrinter(out, args.format)
+    for k in targets:
+        if k not in stale:
+            printer.emit(session.store.get(cmds[k].path_hash), k, cached=True,
+                         sources=cmds[k].sources)
+
+    journal = None if args.no_cache else StateJournal()
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, len(stale))) as pool:
+            futures = {pool.submit(run_cmd, cmds[k], resolved_prefix): k for k in stale}
+            for future in as_completed(futures):
+                k = futures[future]
+                try:
+                    result = future.result()
+                except Superseded:
+                    print(f"[INFO] {k}: saved again, left to the newer request", file=err)
+                    continue
+                except Exception as e:
+                    print(f"[ERROR] {e}", file=err)
+                    continue
+                with session.state_lock:
+                    session.store.put(cmds[k].path_hash, k, result.errors)
+                    update = target_update(state, cmds[k], result, {})
+                    apply_update(state, update)
+                    if journal is not None:
+                        journal.append(update)
+                printer.emit(result.errors, k, cached=False, sources=cmds[k].sources)
+    finally:
+        with session.state_lock:
+            session.store.close()
+        if journal is not None:
+            journal.close()
+
+    printer.summary(err)
+    print(f"[INFO] Checked {len(targets)} focused target(s), compiled {len(stale)}, "
+          f"in {time.monotonic() - started:.2f}s", file=err)
+
+
+class _SocketChannel:
+    """A writable text stream that forwards each write to a daemon client as a message."""
+
+    def __init__(self, wfile, channel: str):
+        self._wfile = wfile
+        self._channel = channel
+        self._gone = False
+
+    def write(self, text: str) -> int:
+        # A client that hung up (Ctrl-C) does not get to abort the run: the results
+        # still go into the state, which is what the next request is answered from.
+        if text and not self._gone:
+            try:
+                send_message(self._wfile, {self._channel: text})
+            except OSError:
+                self._gone = True
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+
+def send_message(wfile, message: Dict) -> None:
+    wfile.write((json.dumps(message) + "\n").encode())
+    wfile.flush()
+
+
+def watch_tree(session: Session, stop: threading.Event) -> None:
+    """Feed every change under the working directory into the session's dirty set.
+
+    Only the working directory: a source or header outside it, under a path prefix
+    elsewhere or in a system include folder, is rehashed by every request instead.
+
+    watchfiles is not among the script's dependencies: a one-shot run, the editor's
+    every save, would pay for installing it and never use it. Started with
+    `uv run --with watchfiles`, the daemon watches; without it, every request
+    rechecks the tree by stat, as a one-shot run does.
+    """
+    # A short debounce: a client asks right after the editor saves, and an event that
+    # has not arrived yet is a change that request will not see.
+    try:
+        try:
+            from watchfiles import watch, DefaultFilter
+        except ImportError:
+            print("[INFO] watchfiles is not installed (uv run --with watchfiles): every "
+                  "request rechecks the tree by stat", file=sys.stderr)
+            return
+        watch_filter = DefaultFilter(ignore_dirs=DefaultFilter.ignore_dirs + (".ronin",))
+        for changes in watch(Path.cwd(), stop_event=stop, debounce=50, step=10,
+                             watch_filter=watch_filter):
+            session.mark_dirty([path for _, path in changes])
+    finally:
+        # Without a watcher nothing can be trusted to be unchanged.
+        session.mark_dirty(None)
+
+
+def serve(args) -> int:
+    """Run as the daemon: answer check requests on DAEMON_SOCKET until interrupted."""
+    sock = connect_daemon()
+    if sock is not None:
+        sock.close()
+        print(f"[ERROR] A daemon is already serving {DAEMON_SOCKET}", file=sys.stderr)
+        return 1
+    DAEMON_SOCKET.unlink(missing_ok=True)
+
+    session = Session(load_or_initialize_state(), args.jobs, args.workers, args.shared_cache)
+    STAT_CACHE.load()
+    stop = threading.Event()
+    watcher = threading.Thread(target=watch_tree, args=(session, stop), daemon=True)
+    watcher.start()
+
+    parser = make_parser()
+    with ThreadPoolExecutor(max_workers=session.jobs) as pool:
+        # Warm up now, so the first request pays for its changes and nothing more.
+        with session.run_lock:
+            session.refresh(args, pool)
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                line = self.rfile.readline()
+                if not line:
+                    return  # connect_daemon() checking whether we are up
+                try:
+                    request = json.loads(line)
+                    req_args, _ = parser.parse_known_args(request["argv"])
+                except (ValueError, KeyError, TypeError):
+                    send_message(self.wfile, {"exit": 2})
+                    return
+                except SystemExit as e:
+                    send_message(self.wfile, {"exit": e.code or 0})
+                    return
+
+                out = _SocketChannel(self.wfile, "out")
+                err = _SocketChannel(self.wfile, "err")
+                status = 0
+                # A focus request runs alongside whatever else is running: that is the point.
+                with nullcontext() if req_args.focus else session.run_lock:
+                    try:
+                        check(session, req_args, pool, out, err)
+                    except Exception as e:
+                        print(f"[ERROR] {e}", file=err)
+                        status = 1
+                try:
+                    send_message(self.wfile, {"exit": status})
+                except OSError:
+                    pass
+
+        # SIGTERM too: started in the background, a daemon never sees a Ctrl-C.
+        signal.signal(signal.SIGTERM, _interrupt)
+        with socketserver.ThreadingUnixStreamServer(str(DAEMON_SOCKET), Handler) as server:
+            server.daemon_threads = True
+            try:
+                server.serve_forever()
+            except KeyboardInterrupt:
+                pass
+            finally:
+                stop.set()
+                watcher.join(timeout=2)
+                session.executor.close()
+                DAEMON_SOCKET.unlink(missing_ok=True)
+    return 0
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def connect_daemon() -> Optional[socket.socket]:
+    """A connection to this directory's daemon, or None if none is running."""
+    if not DAEMON_SOCKET.exists():
+        return None
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(str(DAEMON_SOCKET))
+    except OSError:
+        sock.close()
+        return None  # a socket left behind by a daemon that is gone
+    return sock
+
+
+def request_from_daemon(argv: List[str]) -> Optional[int]:
+    """Have a running daemon do this run, streaming its output to ours.
+
+    Returns the run's exit status, or None if there is no daemon to ask -- the caller
+    then does the work itself.
+    """
+    sock = connect_daemon()
+    if sock is None:
+        return None
+    with sock, sock.makefile("rwb") as stream:
+        send_message(stream, {"argv": argv})
+        for line in stream:
+            message = json.loads(line)
+            if "exit" in message:
+                return message["exit"]
+            if "out" in message:
+                sys.stdout.write(message["out"])
+            if "err" in message:
+                sys.stderr.write(message["err"])
+    print("[ERROR] The daemon went away mid-run", file=sys.stderr)
+    return 1
+
+
+def make_parser() -> ArgumentParser:
     parser = ArgumentParser(description="Parse compile_commands.json and report compiler errors")
     parser.add_argument("--compile-commands", help="Path to compile_commands.json", type=str, required=True, dest="compile_commands")
     parser.add_argument("--path-prefix", help="Only analyze files that has this path prefix", type=str, required=True, dest="path_prefix")
@@ -401,15 +2838,59 @@ if __name__ == "__main__":
                         type=str, required=False, default=None, dest="cxx")
     parser.add_argument("--cc", help="Use this C compiler instead of default specified in compile_commands.json",
                         type=str, required=False, default=None, dest="cc")
-    parser.add_argument("-j", "--jobs", help="Number threads to use", type=int, required=False,
+    parser.add_argument("-j", "--jobs", help="Most compilers to run at once; fewer start while memory or load is short", type=int, required=False,
                         default=os.cpu_count() or 4, dest="jobs")
     parser.add_argument("--no-cache", help="Ignore caching and perform analysis from scratch",
                         action="store_true", required=False, dest="no_cache")
     parser.add_argument("--analysis-flags", help="Comma separated analysis flags to use",
                         type=lambda s: s.split(","), required=False, default=["-fsyntax-only"],
                         dest="analysis_flags")
+    parser.add_argument("--format", help="text: file:line:column:message per error; jsonl: one "
+                        "JSON record per error, with its severity, the target that reported it "
+                        "and whether it came from cache", choices=("text", "jsonl"),
+                        required=False, default="text", dest="format")
+    parser.add_argument("--focus", help="Check only the targets of FILE (a source, or a header, "
+                        "checked through one target that includes it) and print their errors "
+                        "as each finishes. A daemon answers this at once, even mid-run, and "
+                        "stops any compile of an older version of FILE", nargs="+",
+                        metavar="FILE", type=str, required=False, default=[], dest="focus")
+    parser.add_argument("--explain", help="Say why FILE (a source, or a header) would be "
+                        "reanalyzed, without analyzing anything", type=str, required=False,
+                        default=None, metavar="FILE", dest="explain")
+    parser.add_argument("--pch", help="Precompile the <...> includes that targets with the same "
+                        "flags all start with, once per group, and check each target with it",
+                        action="store_true", required=False, dest="pch")
+    parser.add_argument("--batch", help="Check up to this many quick targets with the same flags "
+                        "in one compiler process, through a generated Unity file",
+                        type=int, required=False, default=0, dest="batch")
+    parser.add_argument("--worker", help="Also compile on HOST, over ssh, in SLOTS processes "
+                        "(default 1); 'local' runs them on this machine. Workers must see the "
+                        "sources at the same paths. Repeatable", metavar="HOST[:SLOTS]",
+                        action="append", required=False, default=[], dest="workers")
+    parser.add_argument("--shared-cache", help="Also look results up in, and add them to, this "
+                        "folder, keyed by content so other checkouts, users and CI can share it",
+                        metavar="DIR", type=str, required=False, default=None, dest="shared_cache")
+    parser.add_argument("--profile", help="Report where the run's time went, with the N slowest "
+                        f"compiles (default 10), and write a Chrome trace to {PROFILE_TRACE_FILE}",
+                        metavar="N", type=int, nargs="?", const=10, default=0, dest="profile")
+    parser.add_argument("--gc", help="Forget targets compile_commands.json no longer lists, "
+                        "compact the caches and delete files older versions left behind",
+                        action="store_true", required=False, dest="gc")
+    parser.add_argument("--daemon", help="Stay resident, watch the tree and answer later runs from "
+                        "this directory over a Unix socket; those runs then only print its answer. "
+                        "Watching needs watchfiles: uv run --with watchfiles",
+                        action="store_true", required=False, dest="daemon")
+    parser.add_argument("--no-daemon", help="Do the work in this process even if a daemon is running",
+                        action="store_true", required=False, dest="no_daemon")
+    return parser
+
+
+if __name__ == "__main__":
+    # How an Executor starts a worker: with nothing else to go on, each request says it all
+    if sys.argv[1:] == ["--serve-worker"]:
+        sys.exit(serve_worker())
 
-    args, _ = parser.parse_known_args()
+    args, _ = make_parser().parse_known_args()
 
     if not Path(args.compile_commands).exists():
         print(f"[ERROR] File {args.compile_commands} do not exist")
@@ -424,53 +2905,34 @@ if __name__ == "__main__":
         if not words or shutil.which(words[0]) is None:
             print(f"[ERROR] {flag} is not runnable: {value!r}")
             sys.exit(1)
-        
-    ERRORS_CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
-    resolved_prefix = Path(args.path_prefix).resolve()
 
-    state = load_or_initialize_state(args.no_cache)
-    cmds = get_commands_of_interest(args.compile_commands, args.path_prefix, args.cxx, args.cc, args.analysis_flags)
+    # --gc rewrites the state it loaded; without the cache that is an empty one.
+    if args.gc and args.no_cache:
+        print("[ERROR] --gc cleans the cache; it cannot be combined with --no-cache")
+        sys.exit(1)
 
+    ERRORS_CACHE_FOLDER.mkdir(parents=True, exist_ok=True)
+
+    if args.daemon:
+        sys.exit(serve(args))
+
+    # --no-cache means a from-scratch analysis, which the daemon's warm state is not.
+    if not (args.no_cache or args.no_daemon):
+        status = request_from_daemon(sys.argv[1:])
+        if status is not None:
+            sys.exit(status)
+
+    if args.profile:
+        PROFILE.start()
+    with PROFILE.span("load_or_initialize_state"):
+        session = Session(load_or_initialize_state(args.no_cache), args.jobs, args.workers,
+                          None if args.no_cache else args.shared_cache)
+        if not args.no_cache:
+            STAT_CACHE.load()
     # One pool for the whole run: hashing, then compiling. Both are I/O bound and the
     # `with` is what guarantees the threads are joined even if the loop below raises.
-    with ThreadPoolExecutor(max_workers=args.jobs) as executor:
-        hash_sources(cmds, executor)
-        header_hash_cache = prime_header_hashes(state, executor)
-
-        # 1. Determine exactly what needs recompilation
-        changed_files, unchanged_files, _ = get_needs_recompile(cmds, state, header_hash_cache)
-
-        # 2. Dispatch tasks to thread pool
-        futures = { **{executor.submit(run_cmd, cmds[f], resolved_prefix): f for f in changed_files},
-                    **{executor.submit(read_cache, cmds[f], state.targets[f].header_deps): f for f in unchanged_files} }
-
-        for future in as_completed(futures):
-            file = futures[future]
-
-            if file not in state.targets:
-                state.targets[file] = TargetFile(set(), "", "")
-
-            try:
-                errors, file_deps = future.result()
-                state.targets[file].header_deps = file_deps
-                state.targets[file].content_hash = cmds[file].content_hash
-                state.targets[file].path_hash = cmds[file].path_hash
-
-                if errors:
-                    print(''.join(errors).rstrip('\n'))
-            except Exception as e:
-                print(f"[ERROR] {e}", file=sys.stderr)
-
-    # 3. Update cached dependencies & Save State
-    if not args.no_cache:
-        new_unique_deps = {}
-        # Only preserve the dependencies actively used by the current targets
-        for target in state.targets.values():
-            for dep in target.header_deps:
-                if dep not in new_unique_deps:
-                    if dep not in header_hash_cache:
-                        header_hash_cache[dep] = get_file_content_hash(dep)
-                    new_unique_deps[dep] = header_hash_cache[dep]
-                    
-        state.unique_deps = new_unique_deps
-        save_state(state)
+    try:
+        with ThreadPoolExecutor(max_workers=session.jobs) as executor:
+            check(session, args, executor, sys.stdout, sys.stderr)
+    finally:
+        session.executor.close()
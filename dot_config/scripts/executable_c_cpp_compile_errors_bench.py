@@ -0,0 +1,293 @@
+#!/usr/bin/env -S uv run --script
+#
+# /// script
+# requires-python = ">=3.14"
+# dependencies = []
+# ///
+
+"""Benchmark c_cpp_compile_errors.py against a generated C/C++ tree.
+
+The tree is compiled by a stand-in compiler that does no compiling: it follows the
+#include "..." lines to write a .d file, and reports an error wherever a source says
+BENCH_ERROR, as SARIF (fake-clang) or GCC JSON (fake-gcc). What is left to measure is
+the analyzer itself -- parsing, hashing, state, scheduling -- plus one process spawn
+per compile, which the real thing pays too.
+"""
+
+import json
+import os
+import random
+import re
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from argparse import ArgumentParser
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+SCRIPT = Path(__file__).resolve().with_name("c_cpp_compile_errors.py")
+
+SCENARIOS = ("cold", "warm no-op", "header touch", "source touch")
+
+# Matches: [INFO] Compiled 12 target(s) in ...
+COMPILED_RE = re.compile(r"^\[INFO\] Compiled (\d+) target", re.MULTILINE)
+
+FAKE_COMPILER = r'''#!{python}
+import json, os, re, sys
+
+INCLUDE_RE = re.compile(r'^\s*#\s*include\s+"([^"]+)"', re.MULTILINE)
+
+args = sys.argv[1:]
+d_file = args[args.index("-MF") + 1] if "-MF" in args else None
+include_dirs = [a[2:] for a in args if a.startswith("-I")]
+values = {{args[i + 1] for i, a in enumerate(args[:-1]) if a in ("-MF", "-o", "-include")}}
+source = next(a for a in reversed(args)
+              if not a.startswith("-") and a not in values and os.path.isfile(a))
+
+# Errors name a file as it was opened, relative if it was found through a relative
+# -I, as a real compiler's do; the .d file lists absolute paths.
+seen, errors, stack = [], [], [source]
+while stack:
+    path = stack.pop()
+    if os.path.abspath(path) in seen:
+        continue
+    seen.append(os.path.abspath(path))
+    with open(path, encoding="utf8") as f:
+        text = f.read()
+    for n, line in enumerate(text.splitlines(), 1):
+        if "BENCH_ERROR" in line and not line.lstrip().startswith("#"):
+            errors.append((path, n, line.index("BENCH_ERROR") + 1))
+    for name in INCLUDE_RE.findall(text):
+        for base in [os.path.dirname(path), *include_dirs]:
+            candidate = os.path.join(base, name)
+            if os.path.isfile(candidate):
+                stack.append(candidate)
+                break
+
+if d_file:
+    with open(d_file, "w", encoding="utf8") as f:
+        f.write("out.o: " + " \\\n  ".join(seen) + "\n")
+
+if {sarif}:
+    report = {{"runs": [{{"results": [
+        {{"level": "error", "message": {{"text": "use of undeclared identifier 'BENCH_ERROR'"}},
+          "locations": [{{"physicalLocation": {{"artifactLocation": {{"uri": "file://" + p}},
+                                               "region": {{"startLine": l, "startColumn": c}}}}}}]}}
+        for p, l, c in errors]}}]}}
+else:
+    report = [{{"kind": "error", "message": "'BENCH_ERROR' was not declared in this scope",
+                "locations": [{{"caret": {{"file": p, "line": l, "column": c}}}}]}}
+              for p, l, c in errors]
+if errors or {sarif}:
+    sys.stderr.write(json.dumps(report))
+sys.exit(1 if errors else 0)
+'''
+
+
+def write_fake_compilers(root: Path) -> Dict[str, Path]:
+    bin_dir = root / "bin"
+    bin_dir.mkdir(parents=True)
+    compilers = {}
+    for name, sarif in (("fake-clang", True), ("fake-gcc", False)):
+        path = bin_dir / name
+        path.write_text(FAKE_COMPILER.format(python=sys.executable, sarif=sarif), encoding="utf8")
+        path.chmod(0o755)
+        compilers[name] = path
+    return compilers
+
+
+def generate_tree(root: Path, args) -> Tuple[List[Path], List[Path]]:
+    """Write headers, sources and compile_commands.json; return (headers, sources).
+
+    Headers come in `depth` levels, each including up to two of the next level down;
+    every source includes `fanout` headers of the top level. With --unity N, the
+    database lists CMake-style Unity wrappers of N sources each instead.
+    """
+    rnd = random.Random(args.seed)
+    include = root / "include"
+    src = root / "src"
+    include.mkdir(parents=True)
+    src.mkdir(parents=True)
+
+    per_level = max(1, args.headers // args.depth)
+    levels = [[include / f"l{level}_h{i}.h" for i in range(per_level)]
+              for level in range(args.depth)]
+    for level, headers in enumerate(levels):
+        below = levels[level + 1] if level + 1 < len(levels) else []
+        for i, header in enumerate(headers):
+            includes = rnd.sample(below, min(2, len(below)))
+            lines = ["#pragma once"] + [f'#include "{h.name}"' for h in includes]
+            lines += [f"int {header.stem}_fn{k}(int x);" for k in range(20)]
+            header.write_text("\n".join(lines) + "\n", encoding="utf8")
+
+    suffix = ".cpp" if args.compiler == "fake-clang" else ".c"
+    sources = []
+    for i in range(args.tus):
+        source = src / f"dir{i % 50}" / f"tu{i}{suffix}"
+        source.parent.mkdir(exist_ok=True)
+        includes = rnd.sample(levels[0], min(args.fanout, len(levels[0])))
+        lines = [f'#include "{h.name}"' for h in includes]
+        lines += [f"int tu{i}_fn{k}(int x) {{ return x + {k}; }}" for k in range(30)]
+        if rnd.random() < args.errors:
+            lines.append("int broken(void) { return BENCH_ERROR; }")
+        source.write_text("\n".join(lines) + "\n", encoding="utf8")
+        sources.append(source)
+
+    compiler = root / "bin" / args.compiler
+    targets = sources
+    if args.unity:
+        targets = []
+        for n in range(0, len(sources), args.unity):
+            wrapper = root / "build" / f"unity_{n // args.unity}_cxx{suffix}"
+            wrapper.parent.mkdir(exist_ok=True)
+            wrapper.write_text("/* generated by CMake */\n\n" + "".join(
+                f'#include "{s}"\n' for s in sources[n:n + args.unity]), encoding="utf8")
+            targets.append(wrapper)
+    commands = [{"directory": str(root), "file": str(t),
+                 "command": f"{compiler} -I{include} -O2 -c {t} -o {t.with_suffix('.o')}"}
+                for t in targets]
+    (root / "compile_commands.json").write_text(json.dumps(commands, indent=1), encoding="utf8")
+    return [h for level in levels for h in level], sources
+
+
+def run_analyzer(root: Path, args) -> Tuple[float, int, int]:
+    """One analyzer run: (wall seconds, peak RSS in KiB, targets compiled).
+
+    The peak is wait4's, so the largest of the analyzer and the compilers it reaped;
+    the stand-in compiler is small enough that it is the analyzer's.
+    """
+    argv = [sys.executable, str(args.script), "--compile-commands", "compile_commands.json",
+            "--path-prefix", str(root), "--no-daemon", "-j", str(args.jobs), *args.extra]
+    started = time.perf_counter()
+    process = subprocess.Popen(argv, cwd=root, stdout=subprocess.DEVNULL,
+                               stderr=subprocess.PIPE, text=True)
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - started
+    process.returncode = os.waitstatus_to_exitcode(status)
+    if process.returncode != 0:
+        raise RuntimeError(f"analyzer exited with {process.returncode}:\n{stderr}")
+    peak_kb = usage.ru_maxrss // 1024 if sys.platform == "darwin" else usage.ru_maxrss
+    compiled = sum(int(n) for n in COMPILED_RE.findall(stderr))
+    return elapsed, peak_kb, compiled
+
+
+def analyzer_output(root: Path, args, *extra: str) -> str:
+    """What one analyzer run prints: its errors."""
+    argv = [sys.executable, str(args.script), "--compile-commands", "compile_commands.json",
+            "--path-prefix", str(root), "--no-daemon", *extra]
+    return subprocess.run(argv, cwd=root, capture_output=True, text=True).stdout
+
+
+def check_cut_off(root: Path, args) -> bool:
+    """Whether a cached run reports an error in a header where an uncached one does,
+    after a comment line is added above it: a comment-only change is cut off, but
+    not in a header with errors, whose lines it moves. The header is found through
+    a relative -I, so the error names it by a relative path."""
+    tree = root / "check"
+    (tree / "inc").mkdir(parents=True)
+    header = tree / "inc" / "bad.h"
+    header.write_text("#pragma once\nint bad(void) { return BENCH_ERROR; }\n", encoding="utf8")
+    source = tree / "a.c"
+    source.write_text('#include "bad.h"\nint a;\n', encoding="utf8")
+    compiler = root / "bin" / args.compiler
+    (tree / "compile_commands.json").write_text(json.dumps([{
+        "directory": str(tree), "file": str(source),
+        "command": f"{compiler} -Iinc -c {source} -o a.o"}]), encoding="utf8")
+
+    analyzer_output(tree, args)
+    header.write_text("// a line more\n" + header.read_text(encoding="utf8"), encoding="utf8")
+    cached = analyzer_output(tree, args)
+    fresh = analyzer_output(tree, args, "--no-cache")
+    if cached != fresh or "bad.h:3:" not in fresh:
+        print(f"[ERROR] After a comment line in a header with an error, a cached run "
+              f"printed:\n{cached}where --no-cache printed:\n{fresh}", end="")
+        return False
+    print("[INFO] Cached and uncached runs agree on a header error moved by a comment")
+    return True
+
+
+def touch(path: Path, n: int) -> None:
+    """Change `path` for real: a new declaration, not a comment or a bare mtime."""
+    with open(path, "a", encoding="utf8") as f:
+        f.write(f"int bench_touch_{n};\n")
+
+
+def bench(root: Path, args) -> Dict[str, List[Tuple[float, int, int]]]:
+    headers, sources = generate_tree(root, args)
+    cache = root / ".ronin"
+    rnd = random.Random(args.seed + 1)
+    results = {scenario: [] for scenario in SCENARIOS}
+    for n in range(args.runs):
+        shutil.rmtree(cache, ignore_errors=True)
+        results["cold"].append(run_analyzer(root, args))
+        results["warm no-op"].append(run_analyzer(root, args))
+        touch(rnd.choice(headers), n)
+        results["header touch"].append(run_analyzer(root, args))
+        touch(rnd.choice(sources), n)
+        results["source touch"].append(run_analyzer(root, args))
+    return results
+
+
+def report(results: Dict[str, List[Tuple[float, int, int]]], as_json: bool) -> None:
+    rows = []
+    for scenario, samples in results.items():
+        times = [s[0] for s in samples]
+        rows.append({"scenario": scenario, "median_s": statistics.median(times),
+                     "min_s": min(times), "peak_rss_mib": max(s[1] for s in samples) / 1024,
+                     "compiled": statistics.median(s[2] for s in samples)})
+    if as_json:
+        print(json.dumps(rows, indent=1))
+        return
+    print(f"{'scenario':<14} {'median':>9} {'min':>9} {'peak RSS':>10} {'compiled':>9}")
+    for r in rows:
+        print(f"{r['scenario']:<14} {r['median_s']:8.3f}s {r['min_s']:8.3f}s "
+              f"{r['peak_rss_mib']:7.1f}MiB {r['compiled']:9.0f}")
+
+
+def make_parser() -> ArgumentParser:
+    parser = ArgumentParser(description="Benchmark c_cpp_compile_errors.py on a generated tree "
+                            "with a stand-in compiler. Anything not recognized is passed to it")
+    parser.add_argument("--tus", help="Translation units to generate", type=int, default=2000)
+    parser.add_argument("--headers", help="Headers to generate", type=int, default=400)
+    parser.add_argument("--fanout", help="Headers each source includes", type=int, default=8)
+    parser.add_argument("--depth", help="Levels of headers including headers", type=int, default=4)
+    parser.add_argument("--unity", help="Sources per CMake Unity wrapper; 0 for none",
+                        type=int, default=0)
+    parser.add_argument("--errors", help="Fraction of sources with an error", type=float,
+                        default=0.02)
+    parser.add_argument("--compiler", help="Which stand-in: SARIF or GCC JSON output",
+                        choices=("fake-clang", "fake-gcc"), default="fake-clang")
+    parser.add_argument("--runs", help="Times to repeat every scenario", type=int, default=3)
+    parser.add_argument("-j", "--jobs", help="Passed on to the analyzer", type=int,
+                        default=os.cpu_count() or 4)
+    parser.add_argument("--seed", help="Seed for the generated tree", type=int, default=0)
+    parser.add_argument("--script", help="The analyzer to run", type=Path, default=SCRIPT)
+    parser.add_argument("--keep", help="Keep the generated tree, and print where it is",
+                        action="store_true")
+    parser.add_argument("--json", help="Print results as JSON", action="store_true")
+    parser.add_argument("--check", help="Instead of timing anything, check that a cached run "
+                        "reports header errors where an uncached one does", action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    args, args.extra = make_parser().parse_known_args()
+    if not args.script.exists():
+        print(f"[ERROR] {args.script} does not exist")
+        sys.exit(1)
+
+    root = Path(tempfile.mkdtemp(prefix="cce-bench.")).resolve()
+    try:
+        write_fake_compilers(root)
+        if args.check:
+            sys.exit(0 if check_cut_off(root, args) else 1)
+        report(bench(root, args), args.json)
+    finally:
+        if args.keep:
+            print(f"[INFO] Tree kept in {root}", file=sys.stderr)
+        else:
+            shutil.rmtree(root, ignore_errors=True)
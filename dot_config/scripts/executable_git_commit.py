@@ -15,11 +15,12 @@ DELIMITER          = "@"
 SCRIPT_DIR         = Path(__file__).resolve().parent
 REPO_SCRIPT        = SCRIPT_DIR / "git_repo_list.py"
 LOG_SCRIPT         = SCRIPT_DIR / "git_log.py"
-STATUS_SCRIPT      = SCRIPT_DIR / "lib/git_status.py"
+GIT_CLIENT         = SCRIPT_DIR / "lib/git_client.py"
 COMMIT_ACTIONS     = SCRIPT_DIR / "lib/commit_actions.py"
 TMUX_POPUP         = r'tmux display-popup -w 60% -h 60% -d "$(git rev-parse --show-toplevel)" -E '
 TMUX_PANE          = r'tmux split-window -v -p 40 -c "$(git rev-parse --show-toplevel)" '
-GIT_STATUS_COMMAND = f"uv run {STATUS_SCRIPT}"
+GIT_CLIENT_COMMAND = f"python3 {GIT_CLIENT}"
+GIT_STATUS_COMMAND = f"{GIT_CLIENT_COMMAND} status"
 KOI_DIFF           = "koi --render-mode --language diff"
 
 # git_status.py emits <display><padding>\t<status>@<path>
@@ -94,4 +95,5 @@ if __name__ == "__main__":
     if not pygit2.discover_repository("."):
         print("[ERROR] Not inside a Git repository.")
         exit(1)
+    subprocess.run(["python3", str(GIT_CLIENT), "start"])
     StatusPage().run()
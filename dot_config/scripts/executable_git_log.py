@@ -5,6 +5,7 @@
 # dependencies = ["pygit2"]
 # ///
 
+import shlex
 import subprocess
 from typing import Optional, Tuple
 from argparse import ArgumentParser
@@ -17,15 +18,12 @@ PICKER_ESC_RET_CODE     = 130
 SCRIPT_DIR              = Path(__file__).resolve().parent
 REPO_SCRIPT             = SCRIPT_DIR / "git_repo_list.py"
 COMMIT_SCRIPT           = SCRIPT_DIR / "git_commit.py"
-GIT_BRANCH_SCRIPT       = SCRIPT_DIR / "lib/git_branch.py"
-GIT_LOG_FMT             = SCRIPT_DIR / "lib/git_log_fmt.py"
+GIT_CLIENT              = SCRIPT_DIR / "lib/git_client.py"
 BRANCH_ACTIONS          = SCRIPT_DIR / "lib/branch_actions.py"
 COMMIT_ACTIONS          = SCRIPT_DIR / "lib/commit_actions.py"
 
-GIT_BRANCH_BASE_COMMAND = f'uv run {GIT_BRANCH_SCRIPT}'
-GIT_LOG_BASE_COMMAND    = (r'git log --oneline --graph --decorate --color '
-                           r'--pretty=format:"%C(auto)%h%Creset %C(bold cyan)%cn%Creset %C(green)%aD%Creset %s"')
-GIT_LOG_FMT_COMMAND     = f'uv run {GIT_LOG_FMT}'
+GIT_CLIENT_COMMAND      = f'python3 {GIT_CLIENT}'
+GIT_BRANCH_BASE_COMMAND = f'{GIT_CLIENT_COMMAND} branches'
 TMUX_POPUP              = r'tmux display-popup -w 60% -h 60% -d "$(git rev-parse --show-toplevel)" -E '
 TMUX_PANE               = r'tmux split-window -v -p 40 -c "$(git rev-parse --show-toplevel)" '
 KOI_DIFF                = "koi --render-mode --language diff"
@@ -53,10 +51,18 @@ def get_key(selection: str) -> str:
 
 
 def run_picker(producer: str, picker: list, pos: Optional[int] = None) -> Tuple[bool, str]:
-    rows = subprocess.run(["bash", "-c", producer], capture_output=True, text=True).stdout
+    # Piped, not read first: the picker opens on the first rows while the rest stream in.
+    rows = subprocess.Popen(["bash", "-c", producer], stdout=subprocess.PIPE,
+                            stdin=subprocess.DEVNULL)
     if pos:
         picker = picker + ["--initial-list-pos", str(pos)]
-    picked = subprocess.run(picker, input=rows, text=True, capture_output=True)
+    try:
+        picked = subprocess.run(picker, stdin=rows.stdout, text=True, capture_output=True)
+    finally:
+        rows.stdout.close()
+        # A log still streaming stops here; the backend keeps how far it got.
+        rows.terminate()
+        rows.wait()
     if picked.returncode not in (0, 1, PICKER_ESC_RET_CODE):
         exit(picked.returncode)
     if picked.returncode != 0:
@@ -80,7 +86,7 @@ class BranchPage:
             "--prompt", "[ Branch ] ❯ ",
             "--footer", footer,
             "--query-process-command", "gai --no-color -f {{@QUERY@}}",
-            "--preview-command", SPLIT + f'{GIT_LOG_BASE_COMMAND} "$k" --',
+            "--preview-command", SPLIT + f'{GIT_CLIENT_COMMAND} graph "$k"',
             "--preview-dir", "bottom",
             "--preview-size", "70",
             "--reload-command", GIT_BRANCH_BASE_COMMAND,
@@ -107,9 +113,9 @@ class BranchPage:
 
 
 class LogPage:
-    def __init__(self, log_limit: int):
+    def __init__(self, log_limit: Optional[int]):
         self._last_pos: Optional[int] = None
-        self._base_command: str = GIT_LOG_BASE_COMMAND + f" -n{log_limit} "
+        self._log_limit = log_limit
         self._picker = [
             "tooey", "--ansi",
             "--prompt", "[ Log ] ❯ ",
@@ -134,7 +140,9 @@ class LogPage:
             "Alt +  b:Checkout • x:SoftReset • X:HardReset • A:CherryPick • a:CherryPick(NoCommit)\n"
             "       d:OpenDiff • t:TmuxPane  • r:RepoMenu"
         )
-        producer = f"{self._base_command}{branch} -- | {GIT_LOG_FMT_COMMAND}"
+        producer = f"{GIT_CLIENT_COMMAND} log {shlex.quote(branch)}"
+        if self._log_limit:
+            producer += f" {self._log_limit}"
         picker = self._picker + ["--reload-command", producer, "--footer", footer]
         ok, line = run_picker(producer, picker, self._last_pos)
         if not ok:
@@ -195,12 +203,14 @@ class DiffPage:
 
 if __name__ == "__main__":
     cli_args = ArgumentParser(description="Interactive git log")
-    cli_args.add_argument("-n", help="log limit", required=False, type=int, default=100, dest="n")
+    cli_args.add_argument("-n", help="log limit; by default all of history, streamed in while the page is open",
+                          required=False, type=int, default=None, dest="n")
     parsed_args, _ = cli_args.parse_known_args()
 
     if not pygit2.discover_repository("."):
         print("[ERROR] Not a git repository")
         exit(1)
+    subprocess.run(["python3", str(GIT_CLIENT), "start"])
 
     tab0 = BranchPage()
     tab1 = LogPage(parsed_args.n)
@@ -0,0 +1,195 @@
+#!/usr/bin/env -S uv run --script
+#
+# /// script
+# requires-python = ">=3.14"
+# dependencies = ["pygit2"]
+# ///
+
+"""Keep one repository open and serve the git pages' rows from it, over a Unix socket.
+
+Every reload used to be a uv run of its own: resolving the environment, starting an
+interpreter and opening the repository -- 300-600 ms on a big one -- for rows that
+take milliseconds to make. git_log.py and git_commit.py start this once; it pays all
+of that once, then answers git_client.py at <git dir>/ronin-git-backend.sock until
+IDLE_TIMEOUT_S pass without a request, or its own code changes under it.
+
+One request per connection: a JSON line {"op": ..., "args": [...]}, answered with
+"ok" and the rows, or with "error" and why -- the client then makes the rows itself.
+A log is written a page at a time, for as long as the client reads it; how far it
+got is kept, so the next reload writes those rows again without walking for them.
+"""
+
+import fcntl
+import json
+import os
+import socketserver
+import sys
+import threading
+from collections import OrderedDict
+from itertools import islice
+from pathlib import Path
+from typing import Iterator, List, Optional, Tuple
+
+import pygit2
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+import git_branch
+import git_client
+import git_graph
+import git_status
+
+IDLE_TIMEOUT_S = 15 * 60
+
+# Rows made and written per turn of the repository lock: a screenful and more, for
+# a few milliseconds of walking, so the previews are not kept waiting behind a log.
+PAGE_ROWS = 200
+# Walks kept for reloads, one per REV: the log page asks for --all and one branch.
+LOG_CURSORS = 4
+
+# Whose change means this process is serving old code
+SOURCES = [Path(m.__file__) for m in (git_branch, git_client, git_graph, git_status)]
+SOURCES.append(Path(__file__))
+
+
+class LogCursor:
+    """A walk of the log from one REV, and every line it has made so far."""
+
+    def __init__(self, repo: pygit2.Repository, rev: str):
+        self.lines: List[Tuple[str, pygit2.Oid]] = []
+        self._walk = git_graph.log_lines(repo, rev)
+        self._done = False
+
+    def page(self, start: int) -> List[str]:
+        """The rows from line `start` on, up to PAGE_ROWS; walking on for them if they
+        are not made yet. Empty at the end of the log."""
+        if start >= len(self.lines) and not self._done:
+            found = list(islice(self._walk, PAGE_ROWS))
+            self._done = len(found) < PAGE_ROWS
+            self.lines.extend(found)
+        return [git_graph.row(n, line, oid) for n, (line, oid)
+                in enumerate(self.lines[start:start + PAGE_ROWS], start=start + 1)]
+
+
+def log_cursor(server: "Server", rev: str) -> LogCursor:
+    """The walk from `rev`, carried on from the last request if no ref it starts from
+    has moved since."""
+    key = (rev, tuple(git_graph.tips(server.repo, rev)))
+    cursor = server.log_cursors.pop(key, None) or LogCursor(server.repo, rev)
+    server.log_cursors[key] = cursor
+    while len(server.log_cursors) > LOG_CURSORS:
+        server.log_cursors.popitem(last=False)
+    return cursor
+
+
+def log_pages(server: "Server", args: List[str]) -> Iterator[List[str]]:
+    """`log REV [LIMIT]`, a page at a time; the lock is only held to make one."""
+    rev, limit = args[0], int(args[1]) if len(args) > 1 else None
+    with server.lock:
+        cursor = log_cursor(server, rev)
+    sent = 0
+    while limit is None or sent < limit:
+        with server.lock:
+            page = cursor.page(sent)
+        if limit is not None:
+            page = page[:limit - sent]
+        if not page:
+            return
+        yield page
+        sent += len(page)
+
+
+def rows(repo: pygit2.Repository, op: str, args: List[str]) -> Iterator[str]:
+    if op == "branches":
+        yield from git_branch.branch_rows(repo)
+    elif op == "status":
+        yield from git_status.status_rows(repo)
+    elif op == "graph":
+        for line, _ in git_graph.log_lines(repo, args[0], git_client.GRAPH_LIMIT):
+            yield line
+    else:
+        raise ValueError(f"unknown op {op!r}")
+
+
+def encode(page: List[str]) -> bytes:
+    return "".join(f"{row}\n" for row in page).encode("utf8", "surrogateescape")
+
+
+class Handler(socketserver.StreamRequestHandler):
+    def handle(self):
+        pages: Optional[Iterator[List[str]]] = None
+        try:
+            request = json.loads(self.rfile.readline())
+            op, args = request["op"], request.get("args", [])
+            if op == "log":
+                pages = log_pages(self.server, args)
+                # Made before "ok", so a bad REV still leaves the client to fall back
+                answer = encode(next(pages, []))
+            else:
+                # libgit2 objects are not to be shared between threads mid-call
+                with self.server.lock:
+                    answer = encode(list(rows(self.server.repo, op, args)))
+        except Exception as e:
+            self.wfile.write(f"error {e}\n".encode())
+            return
+        try:
+            self.wfile.write(b"ok\n" + answer)
+            for page in pages or ():
+                self.wfile.write(encode(page))
+        except OSError:
+            pass  # the picker went away, or has all it wants
+
+
+class Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    timeout = IDLE_TIMEOUT_S
+
+    def __init__(self, path: str, repo: pygit2.Repository):
+        super().__init__(path, Handler)
+        self.repo = repo
+        self.lock = threading.Lock()
+        self.log_cursors: OrderedDict[Tuple, LogCursor] = OrderedDict()
+        self.idle = False
+        self._stamps = self._code_stamps()
+
+    def handle_timeout(self):
+        self.idle = True
+
+    def outdated(self) -> bool:
+        return self._code_stamps() != self._stamps
+
+    @staticmethod
+    def _code_stamps() -> List[int]:
+        return [p.stat().st_mtime_ns if p.exists() else 0 for p in SOURCES]
+
+
+def serve() -> int:
+    repo_path = pygit2.discover_repository(".")
+    if not repo_path:
+        print("[ERROR] Not a git repository", file=sys.stderr)
+        return 1
+    repo = pygit2.Repository(repo_path)
+
+    # Held for life: of two started at once, the second has nothing to do.
+    lock_file = open(os.path.join(repo.path, git_client.LOCK_NAME), "w")
+    try:
+        fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        return 0
+
+    path = os.path.join(repo.path, git_client.SOCKET_NAME)
+    # Left behind by one that was killed; the lock says nobody is serving it.
+    Path(path).unlink(missing_ok=True)
+    with Server(path, repo) as server:
+        os.chmod(path, 0o600)
+        try:
+            while not (server.idle or server.outdated()):
+                server.handle_request()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            Path(path).unlink(missing_ok=True)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(serve())
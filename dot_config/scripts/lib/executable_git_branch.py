@@ -6,8 +6,12 @@
 # ///
 
 import datetime
+import json
+import os
 import sys
-from re import sub
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Callable, Dict, List, Optional, Tuple
 
 import pygit2
 
@@ -24,25 +28,147 @@ DELIMITER      = "@"
 
 HIDE_PAD = " " * 300
 
+# In the git directory, beside the backend's socket:
+# branch -> [local, upstream, ahead, behind]
+AHEAD_BEHIND_CACHE = "ronin-ahead-behind.json"
+# commit -> [commit time, "author date", subject]
+ROWS_CACHE         = "ronin-branch-rows.json"
+# Fewer pairs than this to count are counted here, not worth starting processes for
+PARALLEL_MIN = 4
 
-def truncate(s: str) -> str:
-    return s[:MAX_BRANCH_LEN - 1] + "…" if len(s) > MAX_BRANCH_LEN else s
+Pair = Tuple[str, str]
+# A column of a row: (text, text as colored); the text is what is measured
+Cell = Tuple[str, str]
 
 
-def strip_ansi(s: str) -> str:
-    return sub(r"\x1b\[[0-9;]*m", "", s)
+def truncate(s: str) -> str:
+    return s[:MAX_BRANCH_LEN - 1] + "…" if len(s) > MAX_BRANCH_LEN else s
 
 
 def format_time(unix_ts: int) -> str:
     return datetime.datetime.fromtimestamp(unix_ts).strftime("%Y-%m-%d %H:%M")
 
 
-def main():
-    repo_path = pygit2.discover_repository(".")
-    if not repo_path:
-        return
-    repo = pygit2.Repository(repo_path)
+def load_cache(repo: pygit2.Repository, name: str) -> Dict[str, list]:
+    try:
+        with open(os.path.join(repo.path, name), encoding="utf8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_cache(repo: pygit2.Repository, name: str, cache: Dict[str, list]) -> None:
+    path = os.path.join(repo.path, name)
+    try:
+        with open(f"{path}.{os.getpid()}", "w", encoding="utf8") as f:
+            json.dump(cache, f)
+        # Whole or not at all: the backend and a plain run may write it at once
+        os.replace(f"{path}.{os.getpid()}", path)
+    except OSError:
+        pass  # next time, then
+
+
+def moved_forward(repo: pygit2.Repository, memo: Dict[Pair, Optional[int]],
+                  new: str, old: str) -> Optional[int]:
+    """How many commits `new` has that `old` does not, if it is `old` moved forward;
+    else None. Cheap for what a fetch or a commit does: the walk stops at `old`."""
+    if (new, old) not in memo:
+        try:
+            ahead, behind = repo.ahead_behind(new, old)
+            memo[new, old] = ahead if behind == 0 else None
+        except (pygit2.GitError, KeyError, ValueError):
+            memo[new, old] = None  # `old` was force-pushed away and collected
+    return memo[new, old]
+
+
+def carried_forward(last: list, pair: Pair,
+                    moved: Callable[[str, str], Optional[int]]) -> Optional[Tuple[int, int]]:
+    """(ahead, behind) of `pair` from the branch's last cached one, where it follows
+    without a walk down to the merge base; else None.
+
+    A branch 0 ahead is inside its upstream, so an upstream moved forward by M
+    commits leaves it 0 ahead and M more behind. Likewise a branch moved forward
+    while 0 behind. With both ahead, the new commits may be the branch's own, merged.
+    """
+    old_local, old_upstream, ahead, behind = last
+    local, upstream = pair
+    if local == old_local and ahead == 0:
+        m = moved(upstream, old_upstream)
+        if m is not None:
+            return 0, behind + m
+    if upstream == old_upstream and behind == 0:
+        m = moved(local, old_local)
+        if m is not None:
+            return ahead + m, 0
+    return None
+
+
+_worker_repo: Optional[pygit2.Repository] = None
+
+
+def _open_repo(path: str) -> None:
+    global _worker_repo
+    _worker_repo = pygit2.Repository(path)
+
 
+def _count(pair: Pair) -> Tuple[int, int]:
+    return _worker_repo.ahead_behind(*pair)
+
+
+def count_ahead_behind(repo: pygit2.Repository, pairs: List[Pair]) -> Dict[Pair, Tuple[int, int]]:
+    """Walk for each pair; in processes if there are enough, as libgit2 holds the GIL."""
+    workers = min(os.cpu_count() or 1, len(pairs))
+    if len(pairs) < PARALLEL_MIN or workers < 2:
+        return {pair: repo.ahead_behind(*pair) for pair in pairs}
+    with ProcessPoolExecutor(workers, initializer=_open_repo, initargs=(repo.path,)) as pool:
+        return dict(zip(pairs, pool.map(_count, pairs)))
+
+
+def ahead_behind(repo: pygit2.Repository, pairs: Dict[str, Pair]) -> Dict[str, Tuple[int, int]]:
+    """(ahead, behind) of each branch's (local, upstream) pair.
+
+    From AHEAD_BEHIND_CACHE where the pair has not changed since the last time, or
+    carried forward from it where only one side moved forward; the rest are counted.
+    """
+    cache = load_cache(repo, AHEAD_BEHIND_CACHE)
+    known = {(l, u): (a, b) for l, u, a, b in cache.values()}
+    moved = partial(moved_forward, repo, {})
+    for name, pair in pairs.items():
+        if pair not in known and name in cache:
+            counts = carried_forward(cache[name], pair, moved)
+            if counts:
+                known[pair] = counts
+    missing = list({pair for pair in pairs.values() if pair not in known})
+    known.update(count_ahead_behind(repo, missing))
+    found = {name: known[pair] for name, pair in pairs.items()}
+
+    updated = {name: [*pair, *found[name]] for name, pair in pairs.items()}
+    if updated != cache:
+        save_cache(repo, AHEAD_BEHIND_CACHE, updated)
+    return found
+
+
+def commit_cells(repo: pygit2.Repository, known: Dict[str, list], oid: str) -> list:
+    """[commit time, "author date", subject] of a branch's commit; from `known` if it
+    was read before."""
+    if oid in known:
+        return known[oid]
+    commit = repo[oid].peel(pygit2.Commit)
+    return [commit.commit_time, f"{commit.author.name} {format_time(commit.commit_time)}",
+            commit.message.split("\n", 1)[0]]
+
+
+def cell(color: str, text: str) -> Cell:
+    return text, f"{color}{text}{C_RESET}"
+
+
+def branch_rows(repo: pygit2.Repository) -> List[str]:
+    """Picker rows: local branches, the checked-out one first, then remote branches no
+    local one tracks; newest first within each.
+
+    A branch's commit is only read when it points somewhere new: what its rows show of
+    it is kept in ROWS_CACHE, by commit.
+    """
     try:
         current_branch = repo.head.shorthand
         head_is_detached = repo.head_is_detached
@@ -50,19 +176,28 @@ def main():
         current_branch = ""
         head_is_detached = True
 
+    known = load_cache(repo, ROWS_CACHE)
+    shown = {}
     rows = []
 
+    def add(priority: int, name: str, oid: str, *cells: Cell) -> None:
+        commit_time, author_date, subject = shown[oid] = commit_cells(repo, known, oid)
+        rows.append([priority, commit_time, name, *cells,
+                     cell(C_GREEN, author_date), cell(C_BOLD_PURPLE, subject)])
+
     # --- Local branches ---
+    local_branches = [(name, repo.branches.local[name]) for name in repo.branches.local]
+    upstreams = {name: branch.upstream for name, branch in local_branches}
+    counts = ahead_behind(repo, {name: (str(branch.target), str(upstreams[name].target))
+                                 for name, branch in local_branches if upstreams[name]})
     tracked_upstreams = set()
-    for name in repo.branches.local:
-        branch = repo.branches.local[name]
-        commit = branch.peel(pygit2.Commit)
-        upstream = branch.upstream
+    for name, branch in local_branches:
+        upstream = upstreams[name]
 
         if upstream:
             upstream_name = upstream.shorthand
             tracked_upstreams.add(upstream_name)
-            ahead, behind = repo.ahead_behind(branch.target, upstream.target)
+            ahead, behind = counts[name]
         else:
             upstream_name = ">>> NO-REMOTE <<<"
             ahead, behind = 0, 0
@@ -73,16 +208,10 @@ def main():
             display_branch = f"{C_BOLD_RED}{display_branch}{C_RESET}"
             priority = 0
 
-        rows.append([
-            priority,
-            commit.commit_time,
-            name,
-            f"{C_CYAN}{display_branch}{C_RESET}",
-            f"{C_ORANGE}{truncate(upstream_name)}{C_RESET}",
-            f"↑ {C_GREEN}{ahead}{C_RESET} ↓ {C_GREEN}{behind}{C_RESET}",
-            f"{C_GREEN}{commit.author.name} {format_time(commit.commit_time)}{C_RESET}",
-            f"{C_BOLD_PURPLE}{commit.message.split(chr(10), 1)[0]}{C_RESET}",
-        ])
+        add(priority, name, str(branch.target),
+            (truncate(name), f"{C_CYAN}{display_branch}{C_RESET}"),
+            cell(C_ORANGE, truncate(upstream_name)),
+            (f"↑ {ahead} ↓ {behind}", f"↑ {C_GREEN}{ahead}{C_RESET} ↓ {C_GREEN}{behind}{C_RESET}"))
 
     # --- Remote-only branches (not tracked by any local branch) ---
     for name in repo.branches.remote:
@@ -92,17 +221,11 @@ def main():
         if shorthand in tracked_upstreams:
             continue
         branch = repo.branches.remote[name]
-        commit = branch.peel(pygit2.Commit)
-        rows.append([
-            2,
-            commit.commit_time,
-            shorthand,
-            f"{C_ORANGE}{truncate(shorthand)}{C_RESET}",
-            "",
-            "",
-            f"{C_GREEN}{commit.author.name} {format_time(commit.commit_time)}{C_RESET}",
-            f"{C_BOLD_PURPLE}{commit.message.split(chr(10), 1)[0]}{C_RESET}",
-        ])
+        add(2, shorthand, str(branch.target), cell(C_ORANGE, truncate(shorthand)), ("", ""), ("", ""))
+
+    if shown != known:
+        # Only the commits branches point at now: one deleted or moved is not kept
+        save_cache(repo, ROWS_CACHE, shown)
 
     rows.sort(key=lambda r: (r[0], -r[1]))
 
@@ -111,17 +234,28 @@ def main():
     printable = [row[3:] for row in rows]
 
     if not printable:
-        return
+        return []
 
-    col_widths = [max(len(strip_ansi(col)) for col in colset) for colset in zip(*printable)]
+    # Measured on the text as it is before coloring, which is what takes up columns
+    col_widths = [max(len(text) for text, _ in colset) for colset in zip(*printable)]
 
     # The branch name goes last: it is the field that may contain an '@' of its own,
     # and the last field keeps whatever delimiters are left.
+    lines = []
     for line_num, (full_name, row) in enumerate(zip(full_names, printable), start=1):
         aligned = []
-        for col, width in zip(row, col_widths):
-            aligned.append(col + " " * (width - len(strip_ansi(col))))
-        print(f"{'  '.join(aligned)}{HIDE_PAD}\t{line_num}{DELIMITER}{full_name}")
+        for (text, colored), width in zip(row, col_widths):
+            aligned.append(colored + " " * (width - len(text)))
+        lines.append(f"{'  '.join(aligned)}{HIDE_PAD}\t{line_num}{DELIMITER}{full_name}")
+    return lines
+
+
+def main():
+    repo_path = pygit2.discover_repository(".")
+    if not repo_path:
+        return
+    for line in branch_rows(pygit2.Repository(repo_path)):
+        print(line)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,115 @@
+#!/usr/bin/env -S uv run --script
+#
+# /// script
+# requires-python = ">=3.8"
+# dependencies = []
+# ///
+
+"""Ask this repository's git_backend.py for picker rows, or make them without it.
+
+    git_client.py start | branches | status | log REV [LIMIT] | graph REV
+
+Run it with python3, not uv run: the pages run it on every reload and preview, so
+it must start in milliseconds. It only needs the standard library and Python 3.8,
+so whatever python3 the machine has will do; keep it that way. With no backend to
+ask -- none started yet, gone idle, or failing -- it runs what the pages ran before
+there was one. `start` starts the backend, for the pages to call once as they open.
+"""
+
+import json
+import os
+import socket
+import subprocess
+import sys
+from pathlib import Path
+from typing import List, Optional
+
+SCRIPT_DIR        = Path(__file__).resolve().parent
+GIT_BRANCH_SCRIPT = SCRIPT_DIR / "git_branch.py"
+GIT_STATUS_SCRIPT = SCRIPT_DIR / "git_status.py"
+GIT_GRAPH_SCRIPT  = SCRIPT_DIR / "git_graph.py"
+GIT_BACKEND       = SCRIPT_DIR / "git_backend.py"
+
+# In the repository's git directory, so every worktree has its own
+SOCKET_NAME = "ronin-git-backend.sock"
+LOCK_NAME   = "ronin-git-backend.lock"
+
+# What git_graph.py draws, for previews made without a backend
+GIT_LOG_ARGS = ["log", "--oneline", "--graph", "--decorate", "--color",
+                "--pretty=format:%C(auto)%h%Creset %C(bold cyan)%cn%Creset %C(green)%aD%Creset %s"]
+# A preview pane shows a screenful; --graph without a limit orders all of history first.
+GRAPH_LIMIT = 300
+
+
+def git_dir() -> Optional[str]:
+    found = subprocess.run(["git", "rev-parse", "--absolute-git-dir"],
+                           capture_output=True, text=True)
+    return found.stdout.strip() if found.returncode == 0 else None
+
+
+def connect(path: str) -> Optional[socket.socket]:
+    """A connection to the backend listening at `path`, or None if none is."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        sock.close()
+        return None
+    return sock
+
+
+def request(op: str, args: List[str]) -> bool:
+    """Copy the backend's answer to stdout; False if there was no backend to answer."""
+    directory = git_dir()
+    sock = connect(os.path.join(directory, SOCKET_NAME)) if directory else None
+    if sock is None:
+        return False
+    with sock, sock.makefile("rwb") as stream:
+        stream.write(json.dumps({"op": op, "args": args}).encode() + b"\n")
+        stream.flush()
+        # Nothing is written before the status line, so a refusal leaves stdout clean
+        if stream.readline() != b"ok\n":
+            return False
+        # As it comes: a log arrives a page at a time, and the picker shows the first
+        # while the rest is made.
+        while chunk := stream.read1():
+            sys.stdout.buffer.write(chunk)
+            sys.stdout.buffer.flush()
+    return True
+
+
+def start_backend() -> None:
+    """Start this repository's git_backend.py in the background; one already running
+    makes it exit at once. Until it is up, the client does without it."""
+    subprocess.Popen(["uv", "run", str(GIT_BACKEND)], stdin=subprocess.DEVNULL,
+                     stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, start_new_session=True)
+
+
+def fallback(op: str, args: List[str]) -> int:
+    """What the pages ran before there was a backend."""
+    if op == "branches":
+        return subprocess.run(["uv", "run", str(GIT_BRANCH_SCRIPT)]).returncode
+    if op == "status":
+        return subprocess.run(["uv", "run", str(GIT_STATUS_SCRIPT)]).returncode
+    if op == "log":
+        return subprocess.run(["uv", "run", str(GIT_GRAPH_SCRIPT), *args]).returncode
+    if op == "graph":
+        return subprocess.run(["git", *GIT_LOG_ARGS, f"-n{GRAPH_LIMIT}", args[0], "--"]).returncode
+    print(f"Unknown command: {op}", file=sys.stderr)
+    return 1
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: git_client.py start | branches | status | log REV [LIMIT] | graph REV")
+        sys.exit(1)
+
+    op, args = sys.argv[1], sys.argv[2:]
+    if op == "start":
+        start_backend()
+        sys.exit(0)
+    try:
+        sys.exit(0 if request(op, args) else fallback(op, args))
+    except (BrokenPipeError, KeyboardInterrupt):
+        # The picker stopped reading: it has what it needs.
+        sys.exit(1)
@@ -0,0 +1,201 @@
+#!/usr/bin/env -S uv run --script
+#
+# /// script
+# requires-python = ">=3.14"
+# dependencies = ["pygit2"]
+# ///
+
+"""Walk the log with pygit2 and emit picker rows: graph and commit, then LINE@HASH.
+
+    git_graph.py REV [LIMIT]    REV is a branch, a commit, or --all
+
+Replaces `git log --graph ... | git_log_fmt.py`: the lanes are laid out here, one
+row per commit, so there are no graph-only lines to drop, no colors to strip and no
+hash to find again in each line. A lane is drawn "|" while it waits for a commit,
+"*" on that commit, "/" where it ends by joining the commit of another lane, and
+"\\" where a merge opens it for its second parent.
+"""
+
+import datetime
+import heapq
+import sys
+from itertools import count, islice
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import pygit2
+
+C_YELLOW    = "\033[33m"
+C_BOLD_CYAN = "\033[1;36m"
+C_GREEN     = "\033[32m"
+C_RESET     = "\033[m"
+# The colors git log --graph gives its lanes, in its order
+LANE_COLORS = ["\033[31m", "\033[32m", "\033[33m", "\033[34m", "\033[35m", "\033[36m"]
+
+DELIMITER = "@"
+
+HIDE_PAD = " " * 300
+
+
+def tips(repo: pygit2.Repository, rev: str) -> List[pygit2.Oid]:
+    """Where the walk starts: `rev`, or with --all every ref and HEAD."""
+    if rev != "--all":
+        return [repo.revparse_single(rev).peel(pygit2.Commit).id]
+    found = {}
+    for ref in repo.listall_reference_objects():
+        try:
+            found[ref.peel(pygit2.Commit).id] = None
+        except (pygit2.InvalidSpecError, ValueError, KeyError):
+            continue  # a tag of a tree or a blob, or a ref to nothing
+    if not repo.head_is_unborn:
+        found[repo.head.target] = None
+    return list(found)
+
+
+def walk(repo: pygit2.Repository, starts: Iterable[pygit2.Oid]) -> Iterator[pygit2.Commit]:
+    """Every commit reachable from `starts`, newest committer time first.
+
+    Not repo.walk: libgit2 sorts all of history before it yields anything, 1.5 s on
+    100k commits, where this starts yielding at once. Unlike git's --date-order it
+    does not hold a commit back until all its children are out, which takes that same
+    full pass: a parent committed after one of its children, by a skewed clock, or in
+    the same second, may come first. Its lane then just stops short of it.
+    """
+    heap: List[Tuple[int, int, pygit2.Commit]] = []
+    seen = set()
+    order = count()
+
+    def push(oid: pygit2.Oid) -> None:
+        if oid not in seen:
+            seen.add(oid)
+            commit = repo[oid]
+            heapq.heappush(heap, (-commit.commit_time, next(order), commit))
+
+    for oid in starts:
+        push(oid)
+    while heap:
+        commit = heapq.heappop(heap)[2]
+        yield commit
+        for parent in commit.parent_ids:
+            push(parent)
+
+
+def _lane(glyph: str, lane: int) -> str:
+    return f"{LANE_COLORS[lane % len(LANE_COLORS)]}{glyph}{C_RESET}"
+
+
+def graph(commits: Iterable[pygit2.Commit]) -> Iterator[Tuple[str, pygit2.Commit]]:
+    """Each commit with the lanes drawn on its row.
+
+    A lane waits for one commit: the first parent of the commit above it in the lane.
+    A commit takes the leftmost lane waiting for it, or else the leftmost free one,
+    and other lanes waiting for it end there. Its first parent continues in its lane,
+    and any other parent no lane waits for yet opens one.
+    """
+    lanes: List[Optional[pygit2.Oid]] = []
+    # How each lane looks on a row it passes through
+    cells: List[str] = []
+    waiting: Dict[pygit2.Oid, List[int]] = {}
+    free: List[int] = []
+    shown = set()
+
+    def take_free() -> int:
+        while free:
+            lane = heapq.heappop(free)
+            if lane < len(lanes) and lanes[lane] is None:
+                return lane
+        lanes.append(None)
+        cells.append(" ")
+        return len(lanes) - 1
+
+    def release(lane: int) -> None:
+        lanes[lane] = None
+        cells[lane] = " "
+        heapq.heappush(free, lane)
+
+    for commit in commits:
+        oid = commit.id
+        shown.add(oid)
+        joining = waiting.pop(oid, [])
+        column = min(joining) if joining else take_free()
+        row = cells[:]
+        row[column] = "*"
+        for lane in joining:
+            if lane != column:
+                row[lane] = _lane("/", lane)
+                release(lane)
+
+        parents = [p for p in commit.parent_ids if p not in shown]
+        if parents:
+            lanes[column] = parents[0]
+            cells[column] = _lane("|", column)
+            waiting.setdefault(parents[0], []).append(column)
+            for parent in parents[1:]:
+                if parent in waiting:
+                    continue
+                lane = take_free()
+                if lane == len(row):
+                    row.append(" ")
+                lanes[lane] = parent
+                cells[lane] = _lane("|", lane)
+                row[lane] = _lane("\\", lane)
+                waiting[parent] = [lane]
+        else:
+            release(column)
+
+        while lanes and lanes[-1] is None:
+            lanes.pop()
+            cells.pop()
+        yield " ".join(row).rstrip(), commit
+
+
+def describe(commit: pygit2.Commit) -> str:
+    """What git log --pretty=format:"%h %cn %aD %s" shows, colored as git_log.py had it.
+
+    The hash is as long as it must be to stay unique, and at least 7; git, with
+    core.abbrev unset, starts longer in a big repository: 8 from 16384 objects, 9
+    from 65536.
+    """
+    author = commit.author
+    when = datetime.datetime.fromtimestamp(
+        author.time, datetime.timezone(datetime.timedelta(minutes=author.offset)))
+    subject = " ".join(commit.message.split("\n\n", 1)[0].split("\n")).strip()
+    # %aD does not pad the day: "Sat, 6 Jan 2024"
+    date = f"{when:%a}, {when.day} {when:%b %Y %H:%M:%S %z}"
+    return (f"{C_YELLOW}{commit.short_id}{C_RESET} {C_BOLD_CYAN}{commit.committer.name}{C_RESET} "
+            f"{C_GREEN}{date}{C_RESET} {subject}")
+
+
+def log_lines(repo: pygit2.Repository, rev: str,
+              limit: Optional[int] = None) -> Iterator[Tuple[str, pygit2.Oid]]:
+    """The first `limit` lines of the graph from `rev`, or all of them, each with its
+    commit. Lazily: a line is made when it is asked for."""
+    for lanes, commit in islice(graph(walk(repo, tips(repo, rev))), limit):
+        yield f"{lanes} {describe(commit)}", commit.id
+
+
+def row(line_num: int, line: str, oid: pygit2.Oid) -> str:
+    return f"{line}{HIDE_PAD}\t{line_num}{DELIMITER}{oid}"
+
+
+def log_rows(repo: pygit2.Repository, rev: str, limit: Optional[int] = None) -> Iterator[str]:
+    for line_num, (line, oid) in enumerate(log_lines(repo, rev, limit), start=1):
+        yield row(line_num, line, oid)
+
+
+def main():
+    if len(sys.argv) not in (2, 3):
+        print("Usage: git_graph.py REV [LIMIT]")
+        sys.exit(1)
+    repo_path = pygit2.discover_repository(".")
+    if not repo_path:
+        return
+    limit = int(sys.argv[2]) if len(sys.argv) == 3 else None
+    for line in log_rows(pygit2.Repository(repo_path), sys.argv[1], limit):
+        print(line, flush=True)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except (KeyboardInterrupt, BrokenPipeError):
+        sys.exit(1)
@@ -5,6 +5,8 @@
 # dependencies = ["pygit2"]
 # ///
 
+from typing import List
+
 import pygit2
 
 cS = "\033[1;32m"  # staged (green)
@@ -33,24 +35,30 @@ WT_FLAGS = (
 )
 
 
-def main():
-    repo_path = pygit2.discover_repository(".")
-    if not repo_path:
-        return
-    repo = pygit2.Repository(repo_path)
+def status_rows(repo: pygit2.Repository) -> List[str]:
+    rows = []
     for path, flags in repo.status().items():
         if flags == pygit2.GIT_STATUS_IGNORED:
             continue
 
         if flags & pygit2.GIT_STATUS_CONFLICTED:
-            print(f"{cC}C {c0}{path}{HIDE_PAD}\tC{DELIMITER}{path}")
+            rows.append(f"{cC}C {c0}{path}{HIDE_PAD}\tC{DELIMITER}{path}")
         elif flags & pygit2.GIT_STATUS_WT_NEW:
-            print(f"{cQ}? {c0}{path}{HIDE_PAD}\t?{DELIMITER}{path}")
+            rows.append(f"{cQ}? {c0}{path}{HIDE_PAD}\t?{DELIMITER}{path}")
         else:
             if flags & INDEX_FLAGS:
-                print(f"{cS}S {c0}{path}{HIDE_PAD}\tS{DELIMITER}{path}")
+                rows.append(f"{cS}S {c0}{path}{HIDE_PAD}\tS{DELIMITER}{path}")
             if flags & WT_FLAGS:
-                print(f"{cU}U {c0}{path}{HIDE_PAD}\tU{DELIMITER}{path}")
+                rows.append(f"{cU}U {c0}{path}{HIDE_PAD}\tU{DELIMITER}{path}")
+    return rows
+
+
+def main():
+    repo_path = pygit2.discover_repository(".")
+    if not repo_path:
+        return
+    for row in status_rows(pygit2.Repository(repo_path)):
+        print(row)
 
 
 if __name__ == "__main__":